@@ -0,0 +1,248 @@
+import os
+import mmap
+import time
+import struct
+import calendar
+import contextlib
+import threading
+
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+# Timestamp (UTC epoch seconds), value
+RECORD = struct.Struct("<qd")
+EXTENSION = ".col"
+AGGREGATES = {"mean": lambda values: sum(values) / len(values),
+              "min": min,
+              "max": max,
+              "first": lambda values: values[0],
+              "last": lambda values: values[-1]}
+
+
+class Archive:
+    """Local time series archive of meter readings.
+
+    Every channel of every meter is an append-only column file <location>/<meterUUID>/<channel>.col
+    of fixed-width records sorted by timestamp. Files are memory-mapped for queries,
+    so range lookups are binary searches and only the requested part of file is read.
+
+    """
+
+    def __init__(self, location, max_open=256):
+        """
+        Args:
+            location (str): Archive directory.
+            max_open (int): Max number of column files kept open for appending, least recently used are closed.
+
+        """
+        self.location = location
+        self.max_open = max_open
+        self.__lock = threading.Lock()
+        # path -> [file descriptor, last timestamp], in order of use
+        self.__writers = OrderedDict()
+        os.makedirs(location, exist_ok=True)
+
+    def __path(self, meter_uuid, channel):
+        return os.path.join(self.location, meter_uuid, quote(channel, safe="") + EXTENSION)
+
+    def __writer(self, path):
+        try:
+            self.__writers.move_to_end(path)
+            return self.__writers[path]
+        except KeyError:
+            while len(self.__writers) >= self.max_open:
+                os.close(self.__writers.popitem(last=False)[1][0])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            size = os.fstat(fd).st_size
+            if size % RECORD.size:
+                # Torn record of interrupted write, appended records have to stay aligned
+                size -= size % RECORD.size
+                os.ftruncate(fd, size)
+            last_ts = None
+            if size >= RECORD.size:
+                with open(path, "rb") as f:
+                    f.seek(size - RECORD.size)
+                    last_ts = RECORD.unpack(f.read(RECORD.size))[0]
+            self.__writers[path] = [fd, last_ts]
+            return self.__writers[path]
+
+    def append(self, meter_uuid, channel, timestamp, value):
+        """Add reading, readings not newer than the last one of the channel are skipped.
+
+        Args:
+            meter_uuid (str):
+            channel (str): Channel code, e.g. "A+0".
+            timestamp (int): UTC epoch seconds.
+            value (float):
+
+        Returns:
+            bool: The return value. True if reading was added.
+
+        """
+        path = self.__path(meter_uuid, channel)
+        with self.__lock:
+            writer = self.__writer(path)
+            if writer[1] is not None and timestamp <= writer[1]:
+                return False
+            os.write(writer[0], RECORD.pack(timestamp, value))
+            writer[1] = timestamp
+            return True
+
+    def insert(self, meter_uuid, channel, timestamp, value):
+        """Add reading at its place by timestamp, replacing reading with the same timestamp.
+
+        Reading older than the last one rewrites the column file, meant for out of order writes
+        like backfill of monthly values.
+
+        Args:
+            meter_uuid (str):
+            channel (str): Channel code, e.g. "A+0".
+            timestamp (int): UTC epoch seconds.
+            value (float):
+
+        Returns:
+            bool: The return value. True if reading was added, False if it replaced one.
+
+        """
+        path = self.__path(meter_uuid, channel)
+        with self.__lock:
+            writer = self.__writer(path)
+            if writer[1] is None or timestamp > writer[1]:
+                os.write(writer[0], RECORD.pack(timestamp, value))
+                writer[1] = timestamp
+                return True
+            with open(path, "rb") as f:
+                data = bytearray(f.read())
+            pos = self.__bisect(data, len(data) // RECORD.size, timestamp)
+            replaced = pos * RECORD.size < len(data) and RECORD.unpack_from(data, pos * RECORD.size)[0] == timestamp
+            data[pos * RECORD.size:(pos + replaced) * RECORD.size] = RECORD.pack(timestamp, value)
+            # Readers see either the old or the new file
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            # Appending descriptor refers to the replaced file
+            os.close(self.__writers.pop(path)[0])
+            return not replaced
+
+    def add_records(self, records):
+        """Add meter records as returned by UM31.export_records()
+
+        Args:
+            records (iterable of dict):
+
+        Returns:
+            int: The return value. Number of added readings.
+
+        """
+        added = 0
+        for record in records:
+            timestamp = calendar.timegm(time.strptime(record["transmittedAt"], "%Y-%m-%dT%H:%M:%SZ"))
+            for channel, value in record["data"].items():
+                if isinstance(value, (int, float)):
+                    added += self.append(record["meterUUID"], channel, timestamp, value)
+        return added
+
+    def meters(self):
+        """UUIDs of meters in archive"""
+        return sorted(name for name in os.listdir(self.location)
+                      if os.path.isdir(os.path.join(self.location, name)))
+
+    def channels(self, meter_uuid):
+        """Channel codes of meter in archive"""
+        try:
+            names = os.listdir(os.path.join(self.location, meter_uuid))
+        except FileNotFoundError:
+            return []
+        return sorted(unquote(name[:-len(EXTENSION)]) for name in names if name.endswith(EXTENSION))
+
+    @staticmethod
+    def __bisect(mm, count, timestamp):
+        # Index of the first record with timestamp >= timestamp
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(mm, mid * RECORD.size)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    @contextlib.contextmanager
+    def __mapped(self, meter_uuid, channel):
+        # Memory-mapped column file and number of records in it, (None, 0) if there is no data
+        try:
+            f = open(self.__path(meter_uuid, channel), "rb")
+        except FileNotFoundError:
+            yield None, 0
+            return
+        with f:
+            count = os.fstat(f.fileno()).st_size // RECORD.size
+            if count == 0:
+                yield None, 0
+                return
+            with mmap.mmap(f.fileno(), count * RECORD.size, access=mmap.ACCESS_READ) as mm:
+                yield mm, count
+
+    def query(self, meter_uuid, channel, start=None, end=None):
+        """Readings of meter channel in time range.
+
+        Args:
+            meter_uuid (str):
+            channel (str): Channel code, e.g. "A+0".
+            start (int): UTC epoch seconds, inclusive. None for the beginning of archive.
+            end (int): UTC epoch seconds, exclusive. None for the end of archive.
+
+        Returns:
+            list of tuple: The return value. (timestamp, value) pairs sorted by timestamp.
+
+        """
+        with self.__mapped(meter_uuid, channel) as (mm, count):
+            if count == 0:
+                return []
+            lo = 0 if start is None else self.__bisect(mm, count, start)
+            hi = count if end is None else self.__bisect(mm, count, end)
+            with memoryview(mm) as view:
+                with view[lo * RECORD.size:hi * RECORD.size] as records:
+                    return list(RECORD.iter_unpack(records))
+
+    def downsample(self, meter_uuid, channel, start, end, step, func="mean"):
+        """Aggregate readings of meter channel in time buckets.
+
+        Args:
+            meter_uuid (str):
+            channel (str): Channel code, e.g. "A+0".
+            start (int): UTC epoch seconds, inclusive, buckets are aligned to it.
+            end (int): UTC epoch seconds, exclusive.
+            step (int): Bucket length in seconds.
+            func (str): One of "mean", "min", "max", "first", "last".
+
+        Returns:
+            list of tuple: The return value. (bucket start, value) pairs for non-empty buckets.
+
+        """
+        aggregate = AGGREGATES[func]
+        result = []
+        with self.__mapped(meter_uuid, channel) as (mm, count):
+            if count == 0:
+                return result
+            lo = self.__bisect(mm, count, start)
+            hi = self.__bisect(mm, count, end)
+            # Records are read as pairs of doubles, the second one of each pair is the value
+            with memoryview(mm) as view, view.cast("d") as doubles:
+                while lo < hi:
+                    bucket = start + (RECORD.unpack_from(mm, lo * RECORD.size)[0] - start) // step * step
+                    bucket_end = min(self.__bisect(mm, count, bucket + step), hi)
+                    with doubles[lo * 2 + 1:bucket_end * 2:2] as values:
+                        result.append((bucket, aggregate(values)))
+                    lo = bucket_end
+        return result
+
+    def close(self):
+        with self.__lock:
+            for fd, last_ts in self.__writers.values():
+                os.close(fd)
+            self.__writers = OrderedDict()
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import calendar
+import serial
+import um31
+import um31codec
+import archive
+
+from datetime import datetime
+
+
+class Backfill:
+    """Bulk read of monthly history from UM-31 over one connection.
+
+    Every completed month is written to the archive with timestamp of the month beginning (UTC)
+    and recorded in the checkpoint file, so an interrupted run resumes with the next month.
+    Months older than ones already in the archive are inserted at their place.
+
+    """
+
+    def __init__(self, um, arch, checkpoint_path):
+        """
+        Args:
+            um (um31.UM31): Connected device.
+            arch (archive.Archive): Archive for monthly values.
+            checkpoint_path (str): JSON file with completed months.
+
+        """
+        self.um = um
+        self.archive = arch
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = self.read_checkpoint()
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict()
+
+    def write_checkpoint(self):
+        # Write to temporary file and rename, so checkpoint is never half-written
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.checkpoint, f, indent=4, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    @staticmethod
+    def month_start(month, now=None):
+        """The latest beginning of month not later than now, UM-31 keeps the last 12 months.
+
+        Args:
+            month (int): Month in range(1..12).
+            now (datetime): Current UTC time, datetime.utcnow() by default.
+
+        Returns:
+            datetime: The return value.
+
+        """
+        now = now or datetime.utcnow()
+        year = now.year if month <= now.month else now.year - 1
+        return datetime(year, month, 1)
+
+    def run(self, months=range(1, 13)):
+        """Read months which are not in checkpoint yet, the oldest first.
+
+        Args:
+            months (iterable of int): Months to read, in range(1..12).
+
+        Returns:
+            dict: The return value. "YYYY-MM" -> number of meters, for months read in this run.
+
+        """
+        now = datetime.utcnow()
+        starts = sorted(self.month_start(month, now) for month in set(months))
+        result = dict()
+        for start in starts:
+            label = start.strftime("%Y-%m")
+            if label in self.checkpoint:
+                print("Skipping", label, "already in archive")
+                continue
+            begin = time.monotonic()
+            timestamp = calendar.timegm(start.timetuple())
+            meters = 0
+            for record in self.um.iter_month_records(start.month):
+                for channel, value in record["data"].items():
+                    if isinstance(value, (int, float)):
+                        self.archive.insert(record["meterUUID"], channel, timestamp, value)
+                meters += 1
+            self.checkpoint[label] = {"meters": meters,
+                                      "completedAt": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+            self.write_checkpoint()
+            result[label] = meters
+            print("Read", label, "for", meters, "meters in", round(time.monotonic() - begin, 1), "sec")
+        return result
+
+
+if __name__ == '__main__':
+    # python backfill.py /dev/ttyUSB0 [first_month last_month]
+    location = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+    port = sys.argv[1]
+    first, last = (int(sys.argv[2]), int(sys.argv[3])) if len(sys.argv) > 3 else (1, 12)
+    um = um31.UM31()
+    um.connect(port, crc_check=True)
+    arch = archive.Archive(os.path.join(location, "archive_month"))
+    try:
+        Backfill(um, arch, os.path.join(location, "backfill.json")).run(range(first, last + 1))
+    except (serial.SerialException, um31codec.CRCError) as e:
+        print("Backfill interrupted, run again to resume:", e)
+    finally:
+        um.disconnect()
+        arch.close()
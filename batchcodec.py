@@ -0,0 +1,120 @@
+import json
+import zlib
+
+from collections import OrderedDict
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+SCHEMA = "um31.batch.v1"
+ENCODINGS = ("json", "msgpack", "cbor")
+
+
+def _dumps(doc, encoding):
+    if encoding == "json":
+        return json.dumps(doc, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    elif encoding == "msgpack":
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        return msgpack.packb(doc, use_bin_type=True)
+    elif encoding == "cbor":
+        if cbor2 is None:
+            raise ImportError("cbor2 is not installed")
+        return cbor2.dumps(doc)
+    else:
+        raise ValueError("encoding must be one of " + ", ".join(ENCODINGS))
+
+
+def _loads(payload, encoding):
+    if encoding == "json":
+        return json.loads(payload.decode("utf-8"))
+    elif encoding == "msgpack":
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        return msgpack.unpackb(payload, raw=False)
+    elif encoding == "cbor":
+        if cbor2 is None:
+            raise ImportError("cbor2 is not installed")
+        return cbor2.loads(payload)
+    else:
+        raise ValueError("encoding must be one of " + ", ".join(ENCODINGS))
+
+
+def _parse_description(meter_description):
+    # "<DEV>, ID=<INT_ID>, S/N=<SNUM>, bus=<BUS>", see UM31._iter_records
+    rest, bus = meter_description.rsplit(", bus=", 1)
+    rest, serial_number = rest.rsplit(", S/N=", 1)
+    device, int_code = rest.rsplit(", ID=", 1)
+    return device, serial_number, int_code, bus
+
+
+def encode_batch(records, encoding="json", compress=False):
+    """Pack meter records of one poll in one compact document
+
+    Document is {"schema": SCHEMA, "spec": ..., "meters": [[meterUUID, meterDescription, transmittedAt,
+    {channel: value}], ...]}. The info block is not sent, it is restored from meterDescription.
+
+    Args:
+        records (iterable of dict): Meter records as returned by UM31.export_records().
+        encoding (str): One of "json", "msgpack" (requires msgpack) or "cbor" (requires cbor2).
+        compress (bool): Compress encoded document with zlib.
+
+    Returns:
+        bytes: The return value. Encoded document.
+
+    """
+    spec = None
+    meters = []
+    for record in records:
+        channels = OrderedDict()
+        for channel, value in record["data"].items():
+            if channel == "_spec":
+                spec = value
+            elif channel != "info":
+                channels[channel] = value
+        meters.append([record["meterUUID"], record["meterDescription"], record["transmittedAt"], channels])
+    payload = _dumps(OrderedDict([("schema", SCHEMA), ("spec", spec), ("meters", meters)]), encoding)
+    if compress:
+        payload = zlib.compress(payload, 9)
+    return payload
+
+
+def decode_batch(payload, encoding="json", compressed=False):
+    """Unpack document made by encode_batch()
+
+    Args:
+        payload (bytes): Encoded document.
+        encoding (str): Encoding used for encode_batch().
+        compressed (bool): Document was compressed with zlib.
+
+    Returns:
+        list of OrderedDict: The return value. Meter records in the same format as UM31.export_records().
+
+    Raises:
+        ValueError: Document schema is not supported.
+
+    """
+    if compressed:
+        payload = zlib.decompress(payload)
+    doc = _loads(payload, encoding)
+    if doc.get("schema") != SCHEMA:
+        raise ValueError("Unsupported batch schema: " + str(doc.get("schema")))
+    records = []
+    for meter_uuid, meter_description, transmitted_at, channels in doc["meters"]:
+        device, serial_number, int_code, bus = _parse_description(meter_description)
+        data_dict = OrderedDict([("_spec", doc["spec"])])
+        data_dict.update(channels)
+        data_dict["info"] = OrderedDict([("DEV", device), ("SNUM", serial_number), ("INT_ID", int_code),
+                                         ("BUS", bus)])
+        records.append(OrderedDict([("meterUUID", meter_uuid),
+                                    ("meterDescription", meter_description),
+                                    ("transmittedAt", transmitted_at),
+                                    ("data", data_dict)]))
+    return records
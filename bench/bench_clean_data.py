@@ -0,0 +1,77 @@
+"""Microbenchmark of UM31._clean_data against the former regex implementation.
+
+Usage:
+    python bench/bench_clean_data.py [dump_file ...]
+
+Dump files are raw payloads as returned by UM31.read_current_values() or UM31.read_month_values(),
+e.g. saved with open("data.txt", "wb").write(data). Without arguments READCURR and READMONTH
+payloads of the UM-31 simulator are used.
+
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import um31  # noqa: E402
+import um31sim  # noqa: E402
+
+
+def legacy_clean_data(data):
+    """_clean_data as it was before the single pass tokenizer"""
+    inter0 = data.decode("utf-8", "ignore")
+    if inter0.startswith("READ"):
+        inter1 = re.sub(r"[\s]", " ", inter0)
+        inter2 = re.sub(r"END(.*?)BL", " ", inter1)
+        inter3 = re.sub(r"END.+", "", inter2)
+        inter4 = re.split("=", " ".join(inter3.split()))
+        inter5 = []
+        for i in inter4:
+            inter5.append(list(filter(lambda elem: elem.strip(), re.split("<", i))))
+        return inter5[0][0], inter5[2:]
+    else:
+        return None
+
+
+def make_payload(cmd_word="READCURR", meters=500):
+    """Synthetic payload from the UM-31 simulator in the format of UM31.read_current_values() output
+
+    Args:
+        cmd_word (str): READCURR or READMONTH=MM.
+        meters (int): Number of meters.
+
+    Returns:
+        bytes: The return value. Raw payload.
+
+    """
+    response = um31sim.UM31Simulator(meters=meters).response(cmd_word)
+    # Drop the stop word line, the same as UM31.__execute_cmd
+    return cmd_word.encode("utf-8") + response[:response.rfind(b"\n", 0, response.rfind(b"READ")) + 1]
+
+
+def main(paths):
+    if paths:
+        payloads = []
+        for path in paths:
+            with open(path, "rb") as f:
+                payloads.append((os.path.basename(path), f.read()))
+    else:
+        payloads = [("READCURR x500", make_payload("READCURR")),
+                    ("READMONTH x500", make_payload("READMONTH=02")),
+                    ("READCURR x5000", make_payload("READCURR", meters=5000))]
+
+    um = um31.UM31()
+    print("{:<16} {:>9} {:>12} {:>12} {:>8} {:>6}".format("payload", "bytes", "legacy, ms", "new, ms",
+                                                          "speedup", "equal"))
+    for name, data in payloads:
+        equal = legacy_clean_data(data) == um._clean_data(data)
+        number = max(1, 2000000 // len(data))
+        legacy = min(timeit.repeat(lambda: legacy_clean_data(data), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: um._clean_data(data), number=number, repeat=5)) / number
+        print("{:<16} {:>9} {:>12.3f} {:>12.3f} {:>7.1f}x {:>6}".format(name, len(data), legacy * 1000,
+                                                                       new * 1000, legacy / new, str(equal)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
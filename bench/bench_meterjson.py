@@ -0,0 +1,65 @@
+"""Microbenchmark of meter record JSON encoding: json.dumps(indent=4) against meterjson.MeterSerializer.
+
+Usage:
+    python bench/bench_meterjson.py [--meters 500] [--polls 20]
+
+Records of the UM-31 simulator are encoded once to fill the fragment cache, then for every poll with new
+values and timestamps. Reports CPU microseconds per record and checks the output is equal to json.dumps().
+
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json  # noqa: E402
+import um31  # noqa: E402
+import um31sim  # noqa: E402
+import meterjson  # noqa: E402
+
+
+def make_polls(meters, polls):
+    """Meter records of consecutive READCURR polls of the simulator"""
+    sim = um31sim.UM31Simulator(meters=meters)
+    um = um31.UM31()
+    result = []
+    for _ in range(polls):
+        response = sim.response("READCURR")
+        data = b"READCURR" + response[:response.rfind(b"\n", 0, response.rfind(b"READ")) + 1]
+        result.append(um.export_records(data))
+    return result
+
+
+def bench(name, dumps, polls):
+    records = sum(len(p) for p in polls)
+    start = time.process_time()
+    for poll in polls:
+        for record in poll:
+            dumps(record)
+    elapsed = time.process_time() - start
+    print("{:<32} {:>12.2f}".format(name, elapsed / records * 1e6))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=500)
+    parser.add_argument("--polls", type=int, default=20)
+    args = parser.parse_args()
+
+    polls = make_polls(args.meters, args.polls)
+    serializer = meterjson.MeterSerializer(indent=4)
+    compact = meterjson.MeterSerializer(indent=None)
+    equal = all(serializer.dumps(r) == json.dumps(r, indent=4) for p in polls for r in p)
+
+    print(args.meters, "meters,", args.polls, "polls, equal to json.dumps:", equal)
+    print("{:<32} {:>12}".format("encoder", "us/record"))
+    bench("json.dumps(indent=4)", lambda r: json.dumps(r, indent=4), polls)
+    bench("MeterSerializer", serializer.dumps, polls)
+    bench("json.dumps compact", lambda r: json.dumps(r, separators=(",", ":")), polls)
+    bench("MeterSerializer compact" + (" (orjson)" if meterjson.orjson else ""), compact.dumps, polls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""MQTT publish path benchmark of RestreamClient against an in-process fake broker.
+
+Usage:
+    python bench/bench_mqtt.py [--meters 500] [--polls 2] [--qos 1] [--size 0] [--inflight 20]
+                               [--tls] [--latency 0] [--drop-after 0]
+
+Messages are export_json() payloads of the UM-31 simulator, optionally padded to --size bytes.
+Reports throughput, publish-to-ack latency percentiles and time from dropped connection to
+the next CONNECT, which includes the reconnect backoff of RestreamClient.
+
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import um31  # noqa: E402
+import um31sim  # noqa: E402
+import meterjson  # noqa: E402
+import restreamclient  # noqa: E402
+import fakebroker  # noqa: E402
+
+
+def make_messages(meters, polls, qos, size):
+    """Messages of consecutive polls as built by odin38g_electro.job_function"""
+    sim = um31sim.UM31Simulator(meters=meters, baudrate=None)
+    um = um31.UM31()
+    serializer = meterjson.MeterSerializer(indent=4)
+    msg = []
+    for _ in range(polls):
+        response = sim.response("READCURR")
+        data = b"READCURR" + response[:response.rfind(b"\n", 0, response.rfind(b"READ")) + 1]
+        for record in um.export_records(data):
+            payload = serializer.dumps(record)
+            if size > len(payload):
+                payload += " " * (size - len(payload))
+            msg.append({"topic": "bench/electro", "payload": payload, "qos": qos})
+    return msg
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=500)
+    parser.add_argument("--polls", type=int, default=2)
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2))
+    parser.add_argument("--size", type=int, default=0, help="pad payloads to bytes")
+    parser.add_argument("--inflight", type=int, default=20)
+    parser.add_argument("--tls", action="store_true", help="TLS with self-signed certificate made by openssl")
+    parser.add_argument("--latency", type=float, default=0.0, help="broker acknowledgement delay, sec")
+    parser.add_argument("--drop-after", type=int, default=0, help="broker drops connection every N messages")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    msg = make_messages(args.meters, args.polls, args.qos, args.size)
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_location = fakebroker.make_certificates(tmp) if args.tls else None
+        broker = fakebroker.FakeBroker(cert_location, args.latency, args.drop_after or None)
+
+        sent = dict()
+        latencies = []
+        done = threading.Event()
+
+        def on_delivered(m):
+            latencies.append(time.perf_counter() - sent[id(m["payload"])])
+            if len(latencies) == len(msg):
+                done.set()
+
+        client = restreamclient.RestreamClient("bench", [], cert_location, persistent=True,
+                                               max_inflight=args.inflight)
+        client.on_delivered = on_delivered
+        # Publish time of every message, the first attempt only
+        publish = client.client.publish
+
+        def timed_publish(topic, payload=None, qos=0, retain=False):
+            sent.setdefault(id(payload), time.perf_counter())
+            return publish(topic, payload, qos, retain)
+
+        client.client.publish = timed_publish
+        client.start("127.0.0.1", port=broker.port)
+        deadline = time.monotonic() + 10
+        while not client.client.is_connected() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        start = time.perf_counter()
+        client.publish_batch(msg)
+        if args.qos == 0:
+            # No acknowledgement, done when paho has written everything
+            while client.pending() and time.perf_counter() - start < args.timeout:
+                time.sleep(0.001)
+            done.set()
+        done.wait(args.timeout)
+        elapsed = time.perf_counter() - start
+        client.stop()
+        broker.close()
+
+    size = sum(len(m["payload"]) for m in msg) / len(msg)
+    print(len(msg), "messages of", int(size), "bytes, QoS", args.qos, "TLS" if args.tls else "plain",
+          "latency", args.latency, "drop after", args.drop_after or "never", "in-flight", args.inflight)
+    print("{:<28} {:>12}".format("delivered", str(len(latencies)) + "/" + str(len(msg))))
+    print("{:<28} {:>12.0f}".format("messages/s", len(latencies or msg) / elapsed))
+    print("{:<28} {:>12.2f}".format("MB/s", len(latencies or msg) * size / elapsed / 1e6))
+    if latencies:
+        print("{:<28} {:>12.2f}".format("publish-to-ack p50, ms", percentile(latencies, 0.5) * 1000))
+        print("{:<28} {:>12.2f}".format("publish-to-ack p99, ms", percentile(latencies, 0.99) * 1000))
+    recoveries = [r - d for d, r in zip(broker.drops, broker.reconnects)]
+    if recoveries:
+        print("{:<28} {:>12.2f}".format("reconnect recovery mean, s", statistics.mean(recoveries)))
+        print("{:<28} {:>12.2f}".format("reconnect recovery max, s", max(recoveries)))
+
+
+if __name__ == '__main__':
+    main()
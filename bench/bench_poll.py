@@ -0,0 +1,81 @@
+"""End-to-end poll benchmark of UM31 against the UM-31 simulator on a pseudo-terminal or TCP gateway.
+
+Usage:
+    python bench/bench_poll.py [--meters 50] [--baudrate 9600] [--polls 3] [--jitter 0] [--corruption 0] [--tcp]
+
+Reports per command: latency to the first record, full command time, line throughput
+and parse throughput of export_records().
+
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import um31  # noqa: E402
+import um31sim  # noqa: E402
+import um31codec  # noqa: E402
+
+
+def bench_command(um, name, read, stream, polls):
+    first_record = []
+    total = []
+    throughput = []
+    parse = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        first = None
+        for _ in stream():
+            if first is None:
+                first = time.perf_counter() - start
+        first_record.append(first)
+
+        start = time.perf_counter()
+        data = read()
+        elapsed = time.perf_counter() - start
+        total.append(elapsed)
+        throughput.append(len(data) / elapsed)
+
+        start = time.perf_counter()
+        records = um.export_records(data)
+        parse.append(len(records) / (time.perf_counter() - start))
+    print("{:<10} {:>10.3f} {:>10.3f} {:>10.0f} {:>14.0f}".format(name,
+                                                              statistics.median(first_record),
+                                                              statistics.median(total),
+                                                              statistics.median(throughput),
+                                                              statistics.median(parse)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--meters", type=int, default=50)
+    parser.add_argument("--baudrate", type=int, default=9600)
+    parser.add_argument("--polls", type=int, default=3)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--corruption", type=float, default=0.0)
+    parser.add_argument("--tcp", action="store_true", help="connect through socket:// URL")
+    args = parser.parse_args()
+
+    sim = um31sim.UM31Simulator(meters=args.meters, baudrate=args.baudrate, jitter=args.jitter,
+                                corruption=args.corruption, tcp=args.tcp)
+    um = um31.UM31()
+    um.connect(sim.start(), timeout=5, deadline=600, crc_check=args.corruption > 0, retries=5)
+    print(args.meters, "meters at", args.baudrate, "baud,", args.polls, "polls, medians")
+    print("{:<10} {:>10} {:>10} {:>10} {:>14}".format("command", "first, s", "total, s", "bytes/s", "records/s"))
+    try:
+        bench_command(um, "READCURR", um.read_current_values, um.iter_current_records, args.polls)
+        bench_command(um, "READMONTH", lambda: um.read_month_values(1), lambda: um.iter_month_records(1), args.polls)
+    except um31codec.CRCError as e:
+        print("Too many corrupted responses:", e)
+    except serial.SerialException as e:
+        print("Device didn't answer:", e)
+    finally:
+        um.disconnect()
+        sim.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Minimal in-process MQTT 3.1.1 broker for benchmarks of RestreamClient.
+
+Accepts any client, acknowledges QoS 1 and 2 publishes and discards messages. Can wrap connections
+in TLS, delay acknowledgements to simulate link latency and drop connections after every N messages.
+
+"""
+import os
+import ssl
+import time
+import struct
+import socket
+import subprocess
+import threading
+
+
+def make_certificates(directory):
+    """Self-signed certificate in RestreamClient cert_location layout, the broker uses the same pair
+
+    Args:
+        directory (str): Existing directory for ca.crt, client_cert.pem and client_key.pem.
+
+    Returns:
+        str: The return value. directory.
+
+    """
+    cert = os.path.join(directory, "client_cert.pem")
+    key = os.path.join(directory, "client_key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                    "-keyout", key, "-out", cert], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(cert, "rb") as src, open(os.path.join(directory, "ca.crt"), "wb") as dst:
+        dst.write(src.read())
+    return directory
+
+
+class FakeBroker:
+    def __init__(self, cert_location=None, latency=0.0, drop_after=None):
+        """
+        Args:
+            cert_location (str): Directory from make_certificates() for TLS, None for plain TCP.
+            latency (float): Delay in seconds before every acknowledgement.
+            drop_after (int): Close connection after every drop_after received messages, None to keep it.
+
+        """
+        self.latency = latency
+        self.drop_after = drop_after
+        self.context = None
+        if cert_location is not None:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(os.path.join(cert_location, "client_cert.pem"),
+                                         os.path.join(cert_location, "client_key.pem"))
+        self.received = 0
+        self.connects = 0
+        # time.perf_counter() of dropped connections and of the following CONNECTs
+        self.drops = []
+        self.reconnects = []
+        self.__lock = threading.Lock()
+        self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__listener.bind(("127.0.0.1", 0))
+        self.__listener.listen(5)
+        self.port = self.__listener.getsockname()[1]
+        threading.Thread(target=self.__serve, daemon=True).start()
+
+    def close(self):
+        self.__listener.close()
+
+    def __serve(self):
+        while True:
+            try:
+                client, _ = self.__listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.__handle, args=(client,), daemon=True).start()
+
+    @staticmethod
+    def __read(client, size):
+        data = b""
+        while len(data) < size:
+            chunk = client.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return data
+
+    def __send(self, client, packet):
+        # Acknowledgements from timers and the reading thread share one socket
+        try:
+            with self.__lock:
+                client.sendall(packet)
+        except OSError:
+            pass
+
+    def __ack(self, client, packet):
+        if self.latency:
+            threading.Timer(self.latency, self.__send, (client, packet)).start()
+        else:
+            self.__send(client, packet)
+
+    def __handle(self, client):
+        try:
+            if self.context is not None:
+                client = self.context.wrap_socket(client, server_side=True)
+            while True:
+                header = self.__read(client, 1)[0]
+                multiplier = 1
+                length = 0
+                while True:
+                    digit = self.__read(client, 1)[0]
+                    length += (digit & 127) * multiplier
+                    multiplier *= 128
+                    if not digit & 128:
+                        break
+                body = self.__read(client, length)
+                packet_type = header >> 4
+                if packet_type == 1:
+                    # CONNECT
+                    self.connects += 1
+                    if self.drops:
+                        self.reconnects.append(time.perf_counter())
+                    self.__send(client, b"\x20\x02\x00\x00")
+                elif packet_type == 3:
+                    # PUBLISH
+                    qos = (header >> 1) & 3
+                    topic_length = struct.unpack(">H", body[:2])[0]
+                    mid = body[2 + topic_length:4 + topic_length]
+                    with self.__lock:
+                        self.received += 1
+                        drop = self.drop_after and self.received % self.drop_after == 0
+                    if drop:
+                        # Message is lost with connection before acknowledgement
+                        self.drops.append(time.perf_counter())
+                        client.close()
+                        return
+                    if qos == 1:
+                        self.__ack(client, b"\x40\x02" + mid)
+                    elif qos == 2:
+                        self.__ack(client, b"\x50\x02" + mid)
+                elif packet_type == 6:
+                    # PUBREL
+                    self.__send(client, b"\x70\x02" + body[:2])
+                elif packet_type == 12:
+                    # PINGREQ
+                    self.__send(client, b"\xd0\x00")
+                elif packet_type == 14:
+                    # DISCONNECT
+                    client.close()
+                    return
+        except (EOFError, OSError):
+            client.close()
@@ -0,0 +1,98 @@
+import queue
+import threading
+
+# Marks the end of input of a stage
+_STOP = object()
+
+
+class Collector:
+    """Pipeline of bounded queues between serial reads, parsing and publishing.
+
+    Raw payloads are submitted by readers, e.g. as PollScheduler callback, and converted to messages
+    by a pool of workers. One publisher thread ships messages in batches. When parsing or publishing
+    lags behind, the full queue blocks submit(), so readers wait instead of piling up payloads in memory.
+    A device is read again as soon as its payload is queued, while the previous one is still processed.
+
+    """
+
+    def __init__(self, process, publish, workers=2, raw_size=8, message_size=1000, batch_size=500):
+        """
+        Args:
+            process (function): Called with submit() arguments in a worker thread, returns list of messages.
+            publish (function): Called with list of messages in the publisher thread.
+            workers (int): Number of worker threads.
+            raw_size (int): Max number of payloads waiting for workers.
+            message_size (int): Max number of messages waiting for publisher.
+            batch_size (int): Max number of messages in one publish() call.
+
+        """
+        self.process = process
+        self.publish = publish
+        self.batch_size = batch_size
+        self.__raw = queue.Queue(raw_size)
+        self.__messages = queue.Queue(message_size)
+        self.__workers = [threading.Thread(target=self.__work, daemon=True) for _ in range(workers)]
+        self.__publisher = threading.Thread(target=self.__ship, daemon=True)
+        self.__closed = False
+
+    def start(self):
+        for worker in self.__workers:
+            worker.start()
+        self.__publisher.start()
+
+    def submit(self, *args):
+        """Queue payload for processing, blocks while all workers are busy and the queue is full.
+
+        Args:
+            *args: Arguments of process(), e.g. (port, job name, UM31, payload).
+
+        """
+        if self.__closed:
+            raise RuntimeError("Collector is stopped")
+        self.__raw.put(args)
+
+    def stop(self, timeout=None):
+        """Process and publish everything submitted before, then stop threads.
+
+        Readers must be stopped before, submit() fails after stop().
+
+        """
+        self.__closed = True
+        for _ in self.__workers:
+            self.__raw.put(_STOP)
+        for worker in self.__workers:
+            worker.join(timeout)
+        self.__messages.put(_STOP)
+        self.__publisher.join(timeout)
+
+    def __work(self):
+        while True:
+            args = self.__raw.get()
+            if args is _STOP:
+                return
+            try:
+                messages = self.process(*args)
+            except Exception as e:
+                print("Can't process payload:", e)
+                continue
+            for message in messages or ():
+                self.__messages.put(message)
+
+    def __ship(self):
+        stopping = False
+        while not stopping:
+            batch = [self.__messages.get()]
+            # Take what is already waiting, without delaying the first message
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.__messages.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stopping = True
+            if batch:
+                try:
+                    self.publish(batch)
+                except Exception as e:
+                    print("Can't publish", len(batch), "messages:", e)
@@ -0,0 +1,93 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class DeadbandFilter:
+    """Last-value cache of meter channels for delta publishing.
+
+    Channel is published when it changed more than its deadband since the last published value.
+    All channels of a meter are published at least once per heartbeat interval.
+
+    """
+
+    def __init__(self, absolute=0.0, percent=0.0, heartbeat=3600, deadbands=None):
+        """
+        Args:
+            absolute (float): Default absolute deadband.
+            percent (float): Default deadband in percent of the last published value.
+            heartbeat (int): Max interval in seconds between full records of a meter.
+            deadbands (dict): Channel code -> (absolute, percent) for channels with own deadbands.
+
+        """
+        self.absolute = absolute
+        self.percent = percent
+        self.heartbeat = heartbeat
+        self.deadbands = deadbands or dict()
+        self.__lock = threading.Lock()
+        # (meterUUID, channel) -> last published value
+        self.__last = dict()
+        # meterUUID -> time of the last full record
+        self.__full_at = dict()
+
+    def __changed(self, channel, value, last):
+        if last is None:
+            return True
+        absolute, percent = self.deadbands.get(channel, (self.absolute, self.percent))
+        delta = abs(value - last)
+        return delta > absolute and delta > abs(last) * percent / 100
+
+    def filter(self, record, now=None):
+        """Drop unchanged channels from meter record.
+
+        Args:
+            record (dict): Meter record as returned by UM31.export_records().
+            now (float): Current time in seconds, time.monotonic() by default.
+
+        Returns:
+            OrderedDict: The return value. Full record on heartbeat; record with "_delta": True in data and
+                only changed channels otherwise; None if nothing changed.
+
+        """
+        now = time.monotonic() if now is None else now
+        meter_uuid = record["meterUUID"]
+        data = record["data"]
+        with self.__lock:
+            full = now - self.__full_at.get(meter_uuid, now - self.heartbeat) >= self.heartbeat
+            changed = OrderedDict()
+            for channel, value in data.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                key = (meter_uuid, channel)
+                if full or self.__changed(channel, value, self.__last.get(key)):
+                    changed[channel] = value
+                    self.__last[key] = value
+            if full:
+                self.__full_at[meter_uuid] = now
+                return record
+        if not changed:
+            return None
+        data_dict = OrderedDict([("_spec", data.get("_spec")), ("_delta", True)])
+        data_dict.update(changed)
+        if "info" in data:
+            data_dict["info"] = data["info"]
+        delta = OrderedDict(record)
+        delta["data"] = data_dict
+        return delta
+
+    def reset(self, meter_uuid=None):
+        """Forget last values, so the next record is full.
+
+        Args:
+            meter_uuid (str): Meter to forget, all meters by default.
+
+        """
+        with self.__lock:
+            if meter_uuid is None:
+                self.__last.clear()
+                self.__full_at.clear()
+            else:
+                self.__full_at.pop(meter_uuid, None)
+                for key in [key for key in self.__last if key[0] == meter_uuid]:
+                    del self.__last[key]
@@ -0,0 +1,99 @@
+import time
+
+from datetime import datetime, timedelta
+
+try:
+    import zoneinfo
+except ImportError:
+    zoneinfo = None
+
+
+class DeviceClock:
+    """Conversion of UM-31 clock readings "dd.mm.YYYY HH:MM:SS" to UTC.
+
+    Offset of the device clock from UTC is measured with GETDATETIME (see UM31.sync_clock()) and kept
+    for max_age, so it includes drift of the device clock. With tz the device is known to keep local time
+    of that zone, and the zone offset is applied per reading, correct across DST changes; the measurement
+    then only adds the drift. Readings are parsed by fixed positions and converted once per distinct text.
+
+    """
+
+    def __init__(self, utc_offset=3, tz=None, max_age=3600):
+        """
+        Args:
+            utc_offset (float): Hours between device clock and UTC until the first measurement.
+            tz (str or tzinfo): Time zone of device clock, e.g. "Europe/Moscow", None for fixed offset.
+            max_age (int): Seconds after which the offset is measured again.
+
+        """
+        if isinstance(tz, str):
+            if zoneinfo is None:
+                raise ImportError("zoneinfo is not available")
+            tz = zoneinfo.ZoneInfo(tz)
+        self.tz = tz
+        self.max_age = max_age
+        # Seconds device clock is ahead of UTC (fixed offset) or of its zone (tz)
+        self.offset = utc_offset * 3600 if tz is None else 0
+        self.__measured = None
+        # Reading text -> UTC ISO 8601 without "Z"
+        self.__cache = dict()
+
+    def expired(self):
+        """True if offset has to be measured"""
+        return self.__measured is None or time.monotonic() - self.__measured > self.max_age
+
+    def measure(self, device_text, utc_time):
+        """Set offset from device clock reading.
+
+        Args:
+            device_text (str): Device clock "dd.mm.YYYY HH:MM:SS".
+            utc_time (float): time.time() when the reading was taken, e.g. middle of the request.
+
+        """
+        # Device truncates to seconds, its clock is half a second ahead on average
+        device_time = self.parse(device_text) + timedelta(seconds=0.5)
+        utc = datetime.utcfromtimestamp(utc_time)
+        if self.tz is not None:
+            utc += self.tz.utcoffset(device_time)
+        self.offset = round((device_time - utc).total_seconds())
+        self.__measured = time.monotonic()
+        self.__cache.clear()
+
+    def failed(self):
+        """Keep the current offset until the next measurement after max_age"""
+        self.__measured = time.monotonic()
+
+    @staticmethod
+    def parse(text):
+        """Parse "dd.mm.YYYY HH:MM:SS" by fixed positions
+
+        Returns:
+            datetime: The return value. Naive device time.
+
+        """
+        return datetime(int(text[6:10]), int(text[3:5]), int(text[0:2]),
+                        int(text[11:13]), int(text[14:16]), int(text[17:19]))
+
+    def utc(self, text):
+        """Convert device clock reading to UTC
+
+        Args:
+            text (str): "dd.mm.YYYY HH:MM:SS" as in TD and TIME fields.
+
+        Returns:
+            str: The return value. UTC time "YYYY-mm-ddTHH:MM:SS".
+
+        """
+        try:
+            return self.__cache[text]
+        except KeyError:
+            pass
+        device_time = self.parse(text)
+        utc = device_time - timedelta(seconds=self.offset)
+        if self.tz is not None:
+            utc -= self.tz.utcoffset(device_time)
+        iso = "%04d-%02d-%02dT%02d:%02d:%02d" % (utc.year, utc.month, utc.day, utc.hour, utc.minute, utc.second)
+        if len(self.__cache) > 4096:
+            self.__cache.clear()
+        self.__cache[text] = iso
+        return iso
@@ -0,0 +1,133 @@
+import json
+import threading
+
+from collections import OrderedDict
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields of record formatted on every call, all other fields are static per meter
+VARIABLE_FIELDS = ("transmittedAt",)
+STATIC_DATA_FIELDS = ("_spec", "info")
+
+
+def _encode_value(value):
+    """Scalar as json.dumps() encodes it, TypeError for containers and unknown types"""
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if value is None:
+        return "null"
+    value_type = type(value)
+    if value_type is float:
+        if value != value:
+            return "NaN"
+        if value == float("inf"):
+            return "Infinity"
+        if value == -float("inf"):
+            return "-Infinity"
+        return float.__repr__(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is str:
+        return encode_basestring_ascii(value)
+    raise TypeError("Not a scalar: " + repr(value))
+
+
+class MeterSerializer:
+    """JSON encoder of meter records with pre-encoded static fragments per meter.
+
+    meterUUID, meterDescription, channel names and info block of a meter don't change between polls,
+    so the record is encoded once with placeholders and split into fragments around them. Next records
+    of the meter only format transmittedAt and channel values between cached fragments. Output is equal
+    to json.dumps(record, indent=4). With indent=None records are encoded compact, by orjson if installed.
+
+    """
+
+    def __init__(self, indent=4, max_meters=100000):
+        """
+        Args:
+            indent (int): Indent of json.dumps(), None for compact output.
+            max_meters (int): Max number of cached meters, the least recently used are dropped.
+
+        """
+        self.indent = indent
+        self.max_meters = max_meters
+        self.__lock = threading.Lock()
+        # (meterUUID, meterDescription, data keys) -> (fragments, variable record keys, variable data keys)
+        self.__templates = OrderedDict()
+
+    def __template(self, record):
+        data = record["data"]
+        key = (record.get("meterUUID"), record.get("meterDescription"), tuple(data))
+        with self.__lock:
+            template = self.__templates.get(key)
+            if template is not None:
+                self.__templates.move_to_end(key)
+                return template
+        fields = tuple(k for k in data if k not in STATIC_DATA_FIELDS)
+        # Placeholders are strings encoded as "\u0000<n>\u0000", which can't appear in real values
+        skeleton = OrderedDict(record)
+        skeleton_data = OrderedDict(data)
+        placeholders = []
+        for field in VARIABLE_FIELDS:
+            if field in skeleton:
+                skeleton[field] = "\0" + str(len(placeholders)) + "\0"
+                placeholders.append(encode_basestring_ascii(skeleton[field]))
+        for field in fields:
+            skeleton_data[field] = "\0" + str(len(placeholders)) + "\0"
+            placeholders.append(encode_basestring_ascii(skeleton_data[field]))
+        skeleton["data"] = skeleton_data
+        text = json.dumps(skeleton, indent=self.indent)
+        fragments = []
+        for placeholder in placeholders:
+            fragment, text = text.split(placeholder, 1)
+            fragments.append(fragment)
+        fragments.append(text)
+        template = (fragments, tuple(f for f in VARIABLE_FIELDS if f in record), fields)
+        with self.__lock:
+            self.__templates[key] = template
+            if len(self.__templates) > self.max_meters:
+                self.__templates.popitem(last=False)
+        return template
+
+    def dumps(self, record):
+        """Encode meter record.
+
+        Args:
+            record (OrderedDict): Meter record as returned by UM31.export_records().
+
+        Returns:
+            str: The return value. JSON string, equal to json.dumps(record, indent=indent).
+
+        """
+        if self.indent is None:
+            if orjson is not None:
+                return orjson.dumps(record).decode("utf-8")
+            return json.dumps(record, separators=(",", ":"))
+        try:
+            fragments, record_fields, data_fields = self.__template(record)
+            data = record["data"]
+            parts = [fragments[0]]
+            i = 1
+            for field in record_fields:
+                parts.append(_encode_value(record[field]))
+                parts.append(fragments[i])
+                i += 1
+            for field in data_fields:
+                parts.append(_encode_value(data[field]))
+                parts.append(fragments[i])
+                i += 1
+            return "".join(parts)
+        except (TypeError, KeyError, AttributeError):
+            # Not a meter record or nested values, encoded as is
+            return json.dumps(record, indent=self.indent)
+
+    def clear(self):
+        """Drop cached fragments, e.g. after UUIDs are reassigned"""
+        with self.__lock:
+            self.__templates.clear()
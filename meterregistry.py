@@ -0,0 +1,101 @@
+import threading
+import uuidict
+
+from collections import namedtuple
+
+MeterInfo = namedtuple("MeterInfo", ["uuid", "description", "device", "serial_number", "int_code", "bus"])
+
+_registries = dict()
+_registries_lock = threading.Lock()
+
+
+class MeterRegistry:
+    """Meters known to the process, indexed by ID/SNUM blocks, serial number and internal ID.
+
+    Meter blocks are parsed and their UUIDs are looked up in UUIDict once, the next rows of the same meter
+    are resolved with one dict lookup. The indexes are dropped when another process changes the UUIDict
+    store, see check(). Lookups are safe from several threads.
+
+    """
+
+    def __init__(self, db_name="um31.uuid", storage="sqlite"):
+        """
+        Args:
+            db_name (str): UUIDict file name.
+            storage (str): UUIDict storage, key of uuidict.STORAGES.
+
+        """
+        self.__lock = threading.Lock()
+        self.__uuid_dict = uuidict.UUIDict(db_name, storage)
+        self.__version = self.__uuid_dict.version()
+        # (ID block, SNUM block) -> MeterInfo
+        self.__by_blocks = dict()
+        self.__by_serial_number = dict()
+        self.__by_int_code = dict()
+
+    def check(self):
+        """Drop cached meters if UUIDict store was changed by another process since the last check
+
+        Returns:
+            bool: The return value. True if cache was dropped.
+
+        """
+        version = self.__uuid_dict.version()
+        if version == self.__version:
+            return False
+        with self.__lock:
+            self.__version = version
+            self.__uuid_dict.storage = self.__uuid_dict.read_dict()
+            self.__by_blocks = dict()
+            self.__by_serial_number = dict()
+            self.__by_int_code = dict()
+        return True
+
+    def lookup(self, id_block, sn_block, parse):
+        """Meter of ID and SNUM blocks of UM-31 row.
+
+        Args:
+            id_block (str): "ID a;b;bus;dev" block.
+            sn_block (str): "SNUM nnnnnnnn" block.
+            parse (function): Called with (id_block, sn_block) for unknown meters,
+                returns (device, serial_number, int_code, bus, description).
+
+        Returns:
+            MeterInfo: The return value.
+
+        """
+        try:
+            return self.__by_blocks[(id_block, sn_block)]
+        except KeyError:
+            pass
+        device, serial_number, int_code, bus, description = parse(id_block, sn_block)
+        with self.__lock:
+            meter = MeterInfo(self.__uuid_dict.get_uuid(description), description, device, serial_number,
+                              int_code, bus)
+            self.__by_blocks[(id_block, sn_block)] = meter
+            self.__by_serial_number[serial_number] = meter
+            self.__by_int_code[int_code] = meter
+        return meter
+
+    def by_serial_number(self, serial_number):
+        """Meter seen with serial number, None if unknown"""
+        return self.__by_serial_number.get(serial_number)
+
+    def by_int_code(self, int_code):
+        """Meter seen with internal ID "aaaa/bbbb", None if unknown"""
+        return self.__by_int_code.get(int_code)
+
+    def meters(self):
+        """All meters seen since the last invalidation"""
+        with self.__lock:
+            return list(self.__by_blocks.values())
+
+
+def get_registry(db_name="um31.uuid", storage="sqlite"):
+    """Process-wide registry for UUIDict file, created on first use"""
+    with _registries_lock:
+        try:
+            return _registries[db_name]
+        except KeyError:
+            registry = _registries[db_name] = MeterRegistry(db_name, storage)
+            return registry
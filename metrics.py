@@ -0,0 +1,128 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+HELP = {"um31_stage_seconds": "Duration of poll and publish stages",
+        "um31_timeouts_total": "UM-31 commands without complete response in time",
+        "um31_crc_errors_total": "UM-31 responses with CRC errors",
+        "um31_probe_skips_total": "UM-31 reads skipped after failed diagnostic probe",
+        "um31_poll_errors_total": "UM-31 polls failed with unexpected errors",
+        "um31_reconnects_total": "Pooled UM-31 connections reopened after failed health check",
+        "mqtt_publish_seconds": "Time from MQTT publish to broker acknowledgement",
+        "mqtt_reconnects_total": "Reconnections to MQTT broker"}
+
+
+class Registry:
+    """Counters and histograms with labels, exported in Prometheus text format"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # name -> {labels tuple -> value} for counters
+        self.__counters = dict()
+        # name -> {labels tuple -> [bucket counts, sum, count]} for histograms
+        self.__histograms = dict()
+
+    def inc(self, name, value=1, **labels):
+        """Increase counter"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self.__lock:
+            series = self.__counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add value to histogram"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.__lock:
+            series = self.__histograms.setdefault(name, dict())
+            try:
+                histogram = series[key]
+            except KeyError:
+                histogram = series[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe duration of with-block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def __labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(k + '="' + v.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                              for k, v in pairs) + "}"
+
+    def render(self):
+        """Metrics in Prometheus text exposition format"""
+        lines = []
+        with self.__lock:
+            for name, series in sorted(self.__counters.items()):
+                lines.append("# HELP " + name + " " + HELP.get(name, name))
+                lines.append("# TYPE " + name + " counter")
+                for key, value in sorted(series.items()):
+                    lines.append(name + self.__labels(key) + " " + repr(value))
+            for name, series in sorted(self.__histograms.items()):
+                lines.append("# HELP " + name + " " + HELP.get(name, name))
+                lines.append("# TYPE " + name + " histogram")
+                for key, (buckets, total, count) in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket in zip(BUCKETS + ("+Inf",), buckets):
+                        cumulative += bucket
+                        lines.append(name + "_bucket" + self.__labels(key, [("le", str(bound))]) + " "
+                                     + str(cumulative))
+                    lines.append(name + "_sum" + self.__labels(key) + " " + repr(total))
+                    lines.append(name + "_count" + self.__labels(key) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Write metrics for node_exporter textfile collector, atomically"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_http_server(self, port, addr=""):
+        """Serve metrics on http://addr:port/metrics in background thread
+
+        Returns:
+            ThreadingHTTPServer: The return value. Call shutdown() to stop.
+
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
@@ -1,7 +1,17 @@
 import time
+import threading
 import um31
+import archive
+import batchcodec
+import deadband
+import meterjson
+import metrics
 import restreamclient
-import ssl
+import spool
+import pollscheduler
+import collector
+import transport
+import readservice
 import os
 from apscheduler.schedulers.background import BackgroundScheduler
 
@@ -9,34 +19,101 @@ location = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__))
 mqtt_broker_host = "185.41.113.138"
 mqtt_client_id = "5e9c1178-a5f0-4dc0-bbbc-d74243aab27c"
 mqtt_topic = "odintsovo38g/electro"
+# Serial ports or URLs of serial gateways, e.g. "socket://10.0.0.5:4001" or "rfc2217://10.0.0.6:2217"
+serial_ports = ["/dev/ttyUSB0"]
+# Nominal seconds between reads of current values, stretched for devices with slow reads
+poll_interval = 600
+# Check devices with short RDIAGN after a failed read, skipping full reads while they are unhealthy
+poll_probe = "after_failure"
+# Time zone of device clocks for DST aware timestamps, e.g. "Europe/Moscow", None for fixed UTC+3
+device_tz = None
+# Threads parsing and encoding payloads while devices are read again
+parse_workers = 2
+# Publish all meters of one poll as one zlib-compressed message to mqtt_topic + "/batch"
+mqtt_batch = False
+# Readings wait in spool file while broker is unreachable, replayed at most spool_rate messages per second
+spool_file = os.path.join(location, "odin38g_electro.spool")
+spool_rate = 50
+spool_interval = 5
+archive_location = os.path.join(location, "archive")
+# Publish only channels changed more than deadband, all channels of each meter at least once per heartbeat
+deadband_absolute = 0.0
+deadband_percent = 0.0
+deadband_heartbeat = 3600
+# Poll and publish timings for node_exporter textfile collector, and on http://host:metrics_port/metrics if set
+metrics_file = os.path.join(location, "odin38g_electro.prom")
+metrics_port = None
+serializer = meterjson.MeterSerializer(indent=4)
+# Latest readings of every meter on http://127.0.0.1:readings_port/meters if set, filled by the regular poll
+readings_port = None
+readings = readservice.ReadingCache()
+# Forwarding runs on schedule and after every poll, one at a time
+forward_lock = threading.Lock()
 
 
-def job_function():
-    um = um31.UM31()
-    um.connect("/dev/ttyUSB0")
-    data = um.read_current_values()
-    um.disconnect()
+def job_function(port, name, um, data):
+    if not data:
+        return []
+    records = um.export_records(data)
+    arch.add_records(records)
+    readings.update(records)
+    records = [r for r in map(dbf.filter, records) if r is not None]
 
     msg = []
-    payld = um.export_json(data)
-    for p in payld:
-        msg.append({"topic": mqtt_topic, "payload": p})
+    with metrics.timer("um31_stage_seconds", stage="json_encode", port="all"):
+        if mqtt_batch:
+            msg.append({"topic": mqtt_topic + "/batch", "payload": batchcodec.encode_batch(records, compress=True)})
+        else:
+            for record in records:
+                msg.append({"topic": mqtt_topic, "payload": serializer.dumps(record)})
+    return msg
+
+
+def publish_function(msg):
+    spl.put(msg)
+    forward_function()
+    metrics.REGISTRY.write_textfile(metrics_file)
 
-    mqttc = restreamclient.RestreamClient(mqtt_client_id, msg, location)
-    try:
-        mqttc.client.connect(mqtt_broker_host, port=8883, keepalive=60)
-        mqttc.client.loop_forever(retry_first_connection=True)
-    except ssl.SSLEOFError as s:
-        print("SSLEOFError: {0}".format(s))
-        pass
-    except OSError as e:
-        print("OS error: {0}".format(e))
-        pass
+
+def forward_function():
+    # Keep no more than one interval of messages in memory of MQTT client
+    with forward_lock:
+        pending = mqttc.pending()
+        if pending == 0:
+            # Nothing waits for acknowledgement, so messages taken and not acknowledged were lost,
+            # e.g. QoS 0 ones on reconnect, and are taken again
+            spl.rewind()
+        limit = spool_rate * spool_interval - pending
+        if mqttc.client.is_connected() and limit > 0:
+            mqttc.publish_batch(spl.take(limit))
 
 
 if __name__ == '__main__':
+    spl = spool.Spool(spool_file)
+    arch = archive.Archive(archive_location)
+    dbf = deadband.DeadbandFilter(deadband_absolute, deadband_percent, deadband_heartbeat)
+    # One TLS session for all jobs, reconnected in background
+    mqttc = restreamclient.RestreamClient(mqtt_client_id, [], location, persistent=True)
+    mqttc.on_delivered = spl.ack
+    mqttc.start(mqtt_broker_host, port=8883, keepalive=60)
+    if metrics_port is not None:
+        metrics_server = metrics.REGISTRY.start_http_server(metrics_port)
+    if readings_port is not None:
+        readings_server = readservice.start_http_server(readings, readings_port)
+
+    # Serial reads, parsing and publishing run in separate stages connected by bounded queues
+    pipeline = collector.Collector(job_function, publish_function, workers=parse_workers)
+    pipeline.start()
+    # Devices are read one command at a time, start times are spread by site and port
+    # Connections stay open between polls, checked and reopened by the pool
+    pool = transport.ConnectionPool()
+    devices = [{"port": port, "pool": pool, "tz": device_tz} for port in serial_ports]
+    poller = pollscheduler.PollScheduler(devices, pipeline.submit, site=mqtt_client_id, probe=poll_probe)
+    poller.add_job("current", um31.UM31.read_current_values, poll_interval)
+    poller.start()
+
     sched = BackgroundScheduler()
-    sched.add_job(job_function, 'cron', minute='0,10,20,30,40,50')
+    sched.add_job(forward_function, 'interval', seconds=spool_interval)
     sched.start()
 
     try:
@@ -46,3 +123,9 @@ if __name__ == '__main__':
     except (KeyboardInterrupt, SystemExit):
         # Not strictly necessary if daemonic mode is enabled but should be done if possible
         sched.shutdown()
+        poller.stop()
+        pipeline.stop()
+        pool.close()
+        mqttc.stop()
+        spl.close()
+        arch.close()
@@ -0,0 +1,193 @@
+import time
+import zlib
+import serial
+import threading
+import um31
+import um31codec
+import metrics
+
+from collections import OrderedDict
+
+
+class PollJob:
+    """Periodic read command of one device with measured duration"""
+
+    def __init__(self, name, cmd, interval, priority=0):
+        """
+        Args:
+            name (str): Job name passed to callback, e.g. "current".
+            cmd (function): Function taking connected UM31 and returning payload, e.g. UM31.read_current_values.
+            interval (int): Nominal time in seconds between job starts.
+            priority (int): Jobs with lower number run first and are not delayed by jobs with higher number.
+
+        """
+        self.name = name
+        self.cmd = cmd
+        self.interval = interval
+        self.priority = priority
+        # Smoothed read duration in seconds, None before the first run
+        self.duration = None
+        self.due = None
+
+
+class PollScheduler:
+    """Polling of several UM-31GSM Devices without overlapping reads of the same device.
+
+    Every device has its own thread running one job at a time, so a slow read delays the next job
+    of this device only and missed starts are skipped instead of piling up. Start times are aligned
+    to wall clock intervals with deterministic offset per site, device and job, so devices of one
+    site and different sites don't hit serial lines and the broker at the same second. The interval
+    is stretched when reads take more than duty of it, and lower priority jobs are postponed when
+    they would overrun the start of a higher priority job.
+
+    """
+
+    def __init__(self, devices, callback, site="", duty=0.5, smoothing=0.3, probe=False, max_skips=3):
+        """
+        Args:
+            devices (list): Serial ports (str) or dicts with UM31.connect() parameters, "port" key is required.
+            callback (function): Called with (port, job name, UM31, payload or None) after every read,
+                in the device thread.
+            site (str): Site identifier mixed in start offsets, e.g. MQTT client id.
+            duty (float): Max fraction of interval the device may be busy with one job.
+            smoothing (float): Weight of the last read in smoothed read duration.
+            probe (bool or str): Check device with UM31.probe() before every job (True) or only after a failed
+                read ("after_failure"), and skip the job if the device is not healthy. Jobs are not skipped
+                if health is unknown.
+            max_skips (int): Read anyway after this many jobs of the device were skipped in a row, so a wrong
+                diagnostic doesn't stop polling for good.
+
+        """
+        self.devices = OrderedDict()
+        for device in devices:
+            if isinstance(device, str):
+                device = {"port": device}
+            self.devices[device["port"]] = dict(device)
+        self.callback = callback
+        self.site = site
+        self.duty = duty
+        self.smoothing = smoothing
+        self.probe = probe
+        self.max_skips = max_skips
+        # Port -> the last result of UM31.probe()
+        self.diagnostics = OrderedDict()
+        self.__failed = set()
+        # Port -> number of jobs skipped in a row
+        self.__skips = dict()
+        self.__jobs = OrderedDict((port, []) for port in self.devices)
+        self.__threads = []
+        self.__stopped = threading.Event()
+
+    def add_job(self, name, cmd, interval, priority=0):
+        """Add job for all devices, before start().
+
+        Args:
+            name (str): Job name passed to callback.
+            cmd (function): Function taking connected UM31 and returning payload, e.g. UM31.read_current_values.
+            interval (int): Nominal time in seconds between job starts.
+            priority (int): Jobs with lower number run first, e.g. 0 for current and 1 for monthly values.
+
+        """
+        for jobs in self.__jobs.values():
+            jobs.append(PollJob(name, cmd, interval, priority))
+
+    def offset(self, port, name, interval):
+        """Deterministic start offset in seconds within interval"""
+        return zlib.crc32((self.site + "/" + port + "/" + name).encode("utf-8")) % (int(interval * 1000) or 1) / 1000
+
+    def interval(self, job):
+        """Effective interval of job, stretched to keep read duration within duty"""
+        if job.duration is None:
+            return job.interval
+        return max(job.interval, job.duration / self.duty)
+
+    def start(self):
+        self.__stopped.clear()
+        now = time.time()
+        for port, jobs in self.__jobs.items():
+            for job in jobs:
+                # The first start in the current wall clock interval, or in the next one if already passed
+                job.due = now - now % job.interval + self.offset(port, job.name, job.interval)
+                if job.due < now:
+                    job.due += job.interval
+            thread = threading.Thread(target=self.__run_device, args=(port,), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop after running reads are finished"""
+        self.__stopped.set()
+        for thread in self.__threads:
+            thread.join(timeout)
+        self.__threads = []
+
+    def __next_job(self, jobs, now):
+        # Due job with the lowest priority number which doesn't overrun a more important job
+        for job in sorted(jobs, key=lambda j: (j.priority, j.due)):
+            if job.due > now:
+                continue
+            expected_end = now + (job.duration or 0)
+            if any(other.priority < job.priority and other.due < expected_end for other in jobs) \
+                    and now - job.due < self.interval(job):
+                continue
+            return job
+        return None
+
+    def __run_device(self, port):
+        jobs = self.__jobs[port]
+        um = um31.UM31()
+        while not self.__stopped.is_set():
+            now = time.time()
+            job = self.__next_job(jobs, now)
+            if job is None:
+                # Postponed jobs are checked again when the next job is due
+                future = [j.due for j in jobs if j.due > now]
+                self.__stopped.wait(min(future) - now if future else 1)
+                continue
+            start = time.monotonic()
+            try:
+                data = self.__poll(um, port, job)
+            except Exception as e:
+                # Unexpected error, e.g. of payload parsing, must not stop polling of the device
+                print("Poll failed for", port, job.name + ":", repr(e))
+                metrics.inc("um31_poll_errors_total", port=port, job=job.name)
+                self.__failed.add(port)
+                data = None
+            duration = time.monotonic() - start
+            if job.duration is None:
+                job.duration = duration
+            else:
+                job.duration += self.smoothing * (duration - job.duration)
+            # Keep the wall clock grid, skipping starts missed during a long read
+            interval = self.interval(job)
+            now = time.time()
+            job.due += interval
+            if job.due <= now:
+                job.due += ((now - job.due) // interval + 1) * interval
+            try:
+                self.callback(port, job.name, um, data)
+            except Exception as e:
+                print("Poll callback failed for", port, job.name + ":", e)
+
+    def __poll(self, um, port, job):
+        try:
+            um.connect(**self.devices[port])
+            if self.probe is True or (self.probe == "after_failure" and port in self.__failed):
+                diagnostic = self.diagnostics[port] = um.probe()
+                if um.is_healthy(diagnostic) is False:
+                    skips = self.__skips.get(port, 0)
+                    if skips < self.max_skips:
+                        self.__skips[port] = skips + 1
+                        print("Skipping", job.name, "read of unhealthy", port)
+                        metrics.inc("um31_probe_skips_total", port=port)
+                        return None
+            self.__skips.pop(port, None)
+            data = job.cmd(um)
+            self.__failed.discard(port)
+            return data
+        except (serial.SerialException, um31codec.CRCError) as e:
+            print("Can't read", port + ":", e)
+            self.__failed.add(port)
+            return None
+        finally:
+            um.disconnect()
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import threading
+import serial
+import um31
+import um31codec
+
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+
+
+class ReadingCache:
+    """Latest record of every meter, refreshed from device at most once per TTL.
+
+    Concurrent requests for stale readings share one refresh call, so the device is read once however
+    many clients ask. Records can also be pushed with update(), e.g. by the regular poll.
+
+    """
+
+    def __init__(self, refresh=None, ttl=60):
+        """
+        Args:
+            refresh (function): Returns list of meter records read from devices, None for push-only cache.
+            ttl (int): Age in seconds after which readings are refreshed on request.
+
+        """
+        self.refresh = refresh
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        # meterUUID -> record
+        self.__records = OrderedDict()
+        self.__by_serial_number = dict()
+        self.__updated = None
+        # Encoded JSON of all records, built on first request after update
+        self.__body = None
+        # Set when refresh in progress is finished, waited for by concurrent requests
+        self.__flight = None
+
+    def update(self, records):
+        """Replace readings of meters in records, readings of other meters are kept"""
+        with self.__lock:
+            for record in records:
+                self.__records[record["meterUUID"]] = record
+                try:
+                    self.__by_serial_number[record["data"]["info"]["SNUM"]] = record["meterUUID"]
+                except KeyError:
+                    pass
+            self.__updated = time.monotonic()
+            self.__body = None
+
+    def age(self):
+        """Seconds since the last update, None if never updated"""
+        updated = self.__updated
+        return None if updated is None else time.monotonic() - updated
+
+    def __fresh(self, max_age):
+        age = self.age()
+        if self.refresh is None or (age is not None and age <= (self.ttl if max_age is None else max_age)):
+            return
+        with self.__lock:
+            flight = self.__flight
+            leader = flight is None
+            if leader:
+                flight = self.__flight = threading.Event()
+        if not leader:
+            flight.wait()
+            return
+        try:
+            self.update(self.refresh())
+        except Exception as e:
+            print("Can't refresh readings:", e)
+        finally:
+            with self.__lock:
+                self.__flight = None
+            flight.set()
+
+    def records(self, max_age=None):
+        """Latest records of all meters.
+
+        Args:
+            max_age (int): Refresh if readings are older, in seconds. Default is ttl.
+
+        Returns:
+            list of OrderedDict: The return value. Stale readings if refresh failed.
+
+        """
+        self.__fresh(max_age)
+        with self.__lock:
+            return list(self.__records.values())
+
+    def meter(self, key, max_age=None):
+        """Latest record of meter by meterUUID or serial number, None if unknown"""
+        self.__fresh(max_age)
+        with self.__lock:
+            return self.__records.get(self.__by_serial_number.get(key, key))
+
+    def json(self, max_age=None):
+        """Latest records of all meters as encoded JSON array, cached until the next update"""
+        self.__fresh(max_age)
+        with self.__lock:
+            if self.__body is None:
+                self.__body = json.dumps(list(self.__records.values())).encode("utf-8")
+            return self.__body
+
+
+def _make_handler(cache):
+    class Handler(BaseHTTPRequestHandler):
+        """GET /meters for all meters, GET /meters/<meterUUID or S/N> for one, ?max_age=seconds to refresh"""
+
+        def address_string(self):
+            # Unix socket clients have no address
+            return self.client_address[0] if self.client_address else "unix"
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                max_age = float(parse_qs(url.query)["max_age"][0])
+            except (KeyError, ValueError):
+                max_age = None
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["meters"]:
+                body = cache.json(max_age)
+            elif len(parts) == 2 and parts[0] == "meters":
+                record = cache.meter(parts[1], max_age)
+                if record is None:
+                    self.send_error(404, "Unknown meter")
+                    return
+                body = json.dumps(record).encode("utf-8")
+            else:
+                self.send_error(404)
+                return
+            age = cache.age()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if age is not None:
+                self.send_header("Age", str(int(age)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_http_server(cache, port, addr="127.0.0.1"):
+    """Serve cache on http://addr:port/meters in background thread
+
+    Returns:
+        ThreadingHTTPServer: The return value. Call shutdown() to stop.
+
+    """
+    server = ThreadingHTTPServer((addr, port), _make_handler(cache))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_unix_server(cache, path):
+    """Serve cache over HTTP on Unix socket at path in background thread, e.g. curl --unix-socket path
+
+    Returns:
+        ThreadingUnixStreamServer: The return value. Call shutdown() to stop.
+
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    server = ThreadingUnixStreamServer(path, _make_handler(cache))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def device_reader(devices):
+    """Refresh function reading current values of devices one after another, the only user of their ports
+
+    Args:
+        devices (list): Serial ports (str) or dicts with UM31.connect() parameters, "port" key is required.
+
+    Returns:
+        function: The return value. Returns list of meter records.
+
+    """
+    devices = [{"port": d} if isinstance(d, str) else dict(d) for d in devices]
+    um = um31.UM31()
+
+    def read():
+        records = []
+        for params in devices:
+            try:
+                um.connect(**params)
+                data = um.read_current_values()
+                if data:
+                    records.extend(um.export_records(data))
+            except (serial.SerialException, um31codec.CRCError) as e:
+                print("Can't read", params["port"] + ":", e)
+            finally:
+                um.disconnect()
+        return records
+
+    return read
+
+
+if __name__ == '__main__':
+    # python readservice.py /dev/ttyUSB0 [http_port | unix_socket_path]
+    target = sys.argv[2] if len(sys.argv) > 2 else "8031"
+    reading_cache = ReadingCache(device_reader([sys.argv[1]]), ttl=60)
+    if target.isdigit():
+        read_server = start_http_server(reading_cache, int(target))
+    else:
+        read_server = start_unix_server(reading_cache, target)
+    try:
+        while True:
+            time.sleep(2)
+    except (KeyboardInterrupt, SystemExit):
+        read_server.shutdown()
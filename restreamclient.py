@@ -1,25 +1,188 @@
-import time
 import ssl
+import threading
+import collections
 import paho.mqtt.client as paho
 import paho.mqtt as mqtt
 import os
+import time
+import metrics
+
+
+class _Client(paho.Client):
+    """paho client with network thread surviving socket errors like SSLEOFError on write and callback errors"""
+
+    # True while CONNACK is handled, paho iterates its messages and calls on_publish for resent ones meanwhile
+    handling_connack = False
+    # Called with the client after CONNACK is handled
+    on_connack_done = None
+
+    def _handle_connack(self):
+        self.handling_connack = True
+        try:
+            return super()._handle_connack()
+        finally:
+            self.handling_connack = False
+            if self.on_connack_done is not None:
+                self.on_connack_done(self)
+
+    def _thread_main(self):
+        while True:
+            try:
+                self.loop_forever(retry_first_connection=True)
+                return
+            except OSError as e:
+                print("OS error: {0}".format(e))
+            except mqtt.MQTTException as e:
+                print("MQTT error: {0}".format(e))
+            # Broken socket can't be reused, reconnect with backoff
+            while not self._thread_terminate:
+                self._reconnect_wait()
+                try:
+                    self.reconnect()
+                    break
+                except OSError:
+                    pass
+            if self._thread_terminate:
+                return
 
 
 class RestreamClient:
-    def __init__(self, mqtt_client_id, msg, cert_location):
-        self.client = paho.Client(client_id=mqtt_client_id, userdata=msg)
+    def __init__(self, mqtt_client_id, msg, cert_location, persistent=False, max_inflight=20):
+        """
+        Args:
+            mqtt_client_id (str):
+            msg (list): Messages to publish, dicts with topic, payload, qos, retain keys or tuples.
+            cert_location (str): Directory with ca.crt, client_cert.pem and client_key.pem, None for plain TCP.
+            persistent (bool): Keep connection after all messages are published, see start().
+            max_inflight (int): Max number of messages sent and waiting for broker acknowledgement.
+
+        """
+        self.persistent = persistent
+        self.max_inflight = max_inflight
+        # Called with every message acknowledged by broker, e.g. Spool.ack
+        self.on_delivered = None
+        self.__lock = threading.Lock()
+        # mid -> (message, qos, perf_counter() at publish) of messages waiting for acknowledgement
+        self.__inflight = {}
+        # Held by the thread calling paho publish(), never waited for, see _do_publish()
+        self.__publishing = threading.Lock()
+        self.__sending = False
+        # Number of acknowledged messages whose on_delivered didn't return yet
+        self.__delivering = 0
+        # mids acknowledged before publish() returned them
+        self.__early = set()
+        self.__connected = False
+        # Messages are published in FIFO order
+        self.client = _Client(client_id=mqtt_client_id, userdata=collections.deque(msg))
+        self.client.max_inflight_messages_set(max_inflight)
         self.client.on_connect = self._on_connect
         self.client.on_publish = self._on_publish
         self.client.on_disconnect = self._on_disconnect
+        self.client.on_connack_done = self._on_connack_done
         # self.client.on_log = self._on_log
-        self.client.tls_set(ca_certs=os.path.join(cert_location, "ca.crt"),
-                            certfile=os.path.join(cert_location, "client_cert.pem"),
-                            keyfile=os.path.join(cert_location, "client_key.pem"),
-                            tls_version=ssl.PROTOCOL_TLSv1_2)
-        self.client.tls_insecure_set(True)  # prevents ssl.SSLError: Certificate subject does not match remote hostname.
+        if cert_location is not None:
+            self.client.tls_set(ca_certs=os.path.join(cert_location, "ca.crt"),
+                                certfile=os.path.join(cert_location, "client_cert.pem"),
+                                keyfile=os.path.join(cert_location, "client_key.pem"),
+                                tls_version=ssl.PROTOCOL_TLSv1_2)
+            # prevents ssl.SSLError: Certificate subject does not match remote hostname.
+            self.client.tls_insecure_set(True)
+        # Reconnect delay doubles after every failed attempt
+        self.client.reconnect_delay_set(min_delay=1, max_delay=120)
+
+    def start(self, host, port=8883, keepalive=60):
+        """Connect to MQTT broker in background thread and keep the session until stop().
+
+        Connection is retried with exponential backoff, messages are sent with publish_batch().
+
+        """
+        self.persistent = True
+        self.client.connect_async(host, port=port, keepalive=keepalive)
+        self.client.loop_start()
+
+    def stop(self):
+        """Disconnect from MQTT broker and stop background thread"""
+        try:
+            self.client.disconnect()
+        except OSError as e:
+            print("OS error: {0}".format(e))
+        self.client.loop_stop()
+
+    def publish_batch(self, msg):
+        """Queue messages for publishing, thread-safe. Requires background thread from start().
+
+        Args:
+            msg (list): Messages to publish, dicts with topic, payload, qos, retain keys or tuples.
+
+        """
+        with self.__lock:
+            self.client._userdata.extend(msg)
+        if self.client.is_connected():
+            self._do_publish(self.client)
+
+    def pending(self):
+        """Number of messages waiting for publishing, acknowledgement or return of on_delivered"""
+        with self.__lock:
+            return len(self.client._userdata) + len(self.__inflight) + self.__sending + self.__delivering
+
+    def __can_publish(self, client):
+        return len(client._userdata) != 0 and len(self.__inflight) < self.max_inflight
 
     def _do_publish(self, client):
-        m = client._userdata.pop()
+        """Publish queued messages until in-flight window is full.
+
+        paho calls on_publish holding its message mutex, which publish() takes too, so publish() is never
+        called holding self.__lock. Messages are published by one thread at a time in FIFO order, other
+        threads don't wait for it: the publishing thread checks the window again after it is done.
+
+        """
+        while self.__publishing.acquire(blocking=False):
+            delivered = []
+            try:
+                while True:
+                    with self.__lock:
+                        if not self.__can_publish(client):
+                            break
+                        m = client._userdata.popleft()
+                        self.__sending = True
+                    topic, payload, qos, retain = self._unpack_message(m)
+                    published = time.perf_counter()
+                    try:
+                        info = client.publish(topic, payload, qos, retain)
+                    finally:
+                        with self.__lock:
+                            self.__sending = False
+                    with self.__lock:
+                        if info.mid in self.__early:
+                            delivered.append((m, qos, published))
+                            self.__delivering += 1
+                        else:
+                            self.__inflight[info.mid] = (m, qos, published)
+                        self.__early.clear()
+            finally:
+                self.__publishing.release()
+            for entry in delivered:
+                self.__delivered(entry)
+            with self.__lock:
+                if self.__can_publish(client):
+                    continue
+                done = not self.persistent and len(client._userdata) == 0 and len(self.__inflight) == 0
+            if done:
+                client.disconnect()
+                print("Disconnecting from MQTT broker")
+            return
+
+    def __delivered(self, entry):
+        metrics.observe("mqtt_publish_seconds", time.perf_counter() - entry[2])
+        try:
+            if self.on_delivered is not None:
+                self.on_delivered(entry[0])
+        finally:
+            with self.__lock:
+                self.__delivering -= 1
+
+    @staticmethod
+    def _unpack_message(m):
         if type(m) is dict:
             topic = m["topic"]
             try:
@@ -38,34 +201,52 @@ class RestreamClient:
             (topic, payload, qos, retain) = m
         else:
             raise ValueError("message must be a dict or a tuple")
-        client.publish(topic, payload, qos, retain)
+        return topic, payload, qos, retain
 
     # The callback for when the client receives a CONNACK response from the server.
     def _on_connect(self, client, userdata, flags, rc):
         print(paho.connack_string(rc))
         if rc == 0:
-            if len(userdata) != 0:
-                self._do_publish(client)
-            else:
-                client.disconnect()
-        else:
+            if self.__connected:
+                metrics.inc("mqtt_reconnects_total")
+            self.__connected = True
+            with self.__lock:
+                # paho resends unacknowledged QoS>0 messages itself, QoS 0 ones are lost
+                for mid, (m, qos, published) in list(self.__inflight.items()):
+                    if qos == 0:
+                        del self.__inflight[mid]
+            self._do_publish(client)
+        elif not self.persistent:
             raise mqtt.MQTTException(paho.connack_string(rc))
+        # Refused connection, e.g. server unavailable during maintenance, is retried by paho with backoff
 
     # The callback for when message that was to be sent
     # using the publish() call has completed transmission to the broker.
     def _on_publish(self, client, userdata, mid):
-        if len(userdata) == 0:
-            client.disconnect()
-            print("Disconnecting from MQTT broker")
-        else:
+        with self.__lock:
+            delivered = self.__inflight.pop(mid, None)
+            if delivered is not None:
+                # Pending until on_delivered returns, e.g. until Spool.ack has recorded it
+                self.__delivering += 1
+            elif self.__sending:
+                # QoS 0 or fast acknowledgement of the message being published in another thread
+                self.__early.add(mid)
+        # New messages would change paho message dict iterated during CONNACK, they are published after it
+        if not client.handling_connack:
+            self._do_publish(client)
+        if delivered is not None:
+            self.__delivered(delivered)
+
+    def _on_connack_done(self, client):
+        # Fill window freed by messages resent and delivered while CONNACK was handled
+        if client.is_connected():
             self._do_publish(client)
 
     # The callback for when the client disconnects from the broker.
+    # Reconnection is done by paho network loop with reconnect_delay_set() backoff, don't block it here.
     def _on_disconnect(self, client, userdata, rc):
         if rc != 0:
-            print("on_disconnect: Unexpected disconnection")
-            print("waiting 60 sec and reconnecting")
-            time.sleep(60)
+            print("on_disconnect: Unexpected disconnection, reconnecting")
 
     def _on_log(self, client, userdata, level, string):
         print("on_log:", string)
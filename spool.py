@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+
+
+class Spool:
+    """Durable FIFO queue of MQTT messages between poller and RestreamClient.
+
+    Messages are stored in SQLite database and removed only after broker acknowledgement,
+    so readings survive broker outages and restarts of the process.
+
+    """
+
+    def __init__(self, path, max_messages=100000, ack_batch=100):
+        """
+        Args:
+            path (str): Database file.
+            max_messages (int): Max number of stored messages, the oldest ones are dropped above it.
+            ack_batch (int): Number of acknowledged messages removed from disk in one transaction.
+
+        """
+        self.max_messages = max_messages
+        self.ack_batch = ack_batch
+        self.__lock = threading.Lock()
+        self.__acked = []
+        # Messages up to this id are handed over to publisher and wait for acknowledgement
+        self.__taken_id = 0
+        self.__db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=FULL")
+        self.__db.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                          "topic TEXT NOT NULL, payload BLOB, qos INTEGER NOT NULL, retain INTEGER NOT NULL)")
+
+    def put(self, msg):
+        """Store messages, one disk sync for all of them.
+
+        Args:
+            msg (list): Messages, dicts with topic, payload, qos, retain keys as for RestreamClient.
+
+        """
+        rows = [(m["topic"], m.get("payload"), m.get("qos", 1), int(m.get("retain", False))) for m in msg]
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                self.__db.executemany("INSERT INTO messages (topic, payload, qos, retain) VALUES (?, ?, ?, ?)", rows)
+                excess = self.__db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] - self.max_messages
+                if excess > 0:
+                    self.__db.execute("DELETE FROM messages WHERE id IN "
+                                      "(SELECT id FROM messages ORDER BY id LIMIT ?)", (excess,))
+                    print("Spool is full, dropped", excess, "oldest messages")
+                self.__db.execute("COMMIT")
+            except sqlite3.Error:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def take(self, limit):
+        """Get next messages for publishing in order of storing, without removing them.
+
+        Args:
+            limit (int): Max number of messages.
+
+        Returns:
+            list of dict: The return value. Messages with additional spool_id key for ack().
+
+        """
+        with self.__lock:
+            rows = self.__db.execute("SELECT id, topic, payload, qos, retain FROM messages WHERE id > ? "
+                                     "ORDER BY id LIMIT ?", (self.__taken_id, limit)).fetchall()
+            if rows:
+                self.__taken_id = rows[-1][0]
+        return [{"spool_id": spool_id, "topic": topic, "payload": payload, "qos": qos, "retain": bool(retain)}
+                for spool_id, topic, payload, qos, retain in rows]
+
+    def rewind(self):
+        """Take again all messages which are not acknowledged yet.
+
+        Call when the publisher has nothing in flight, e.g. after messages were dropped on reconnect,
+        otherwise messages still waiting for acknowledgement are published twice.
+
+        """
+        with self.__lock:
+            # Acknowledged messages are removed first, so they are not taken again
+            self.__flush()
+            self.__taken_id = 0
+
+    def ack(self, message):
+        """Remove published message, thread-safe. Suitable for RestreamClient.on_delivered.
+
+        Args:
+            message (dict): Message returned by take().
+
+        """
+        with self.__lock:
+            self.__acked.append((message["spool_id"],))
+            if len(self.__acked) >= self.ack_batch:
+                self.__flush()
+
+    def flush(self):
+        """Remove acknowledged messages from disk now"""
+        with self.__lock:
+            self.__flush()
+
+    def __flush(self):
+        if self.__acked:
+            self.__db.execute("BEGIN IMMEDIATE")
+            self.__db.executemany("DELETE FROM messages WHERE id = ?", self.__acked)
+            self.__db.execute("COMMIT")
+            self.__acked = []
+
+    def __len__(self):
+        with self.__lock:
+            return self.__db.execute("SELECT COUNT(*) FROM messages").fetchone()[0] - len(self.__acked)
+
+    def close(self):
+        self.flush()
+        self.__db.close()
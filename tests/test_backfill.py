@@ -0,0 +1,53 @@
+import os
+import sys
+import calendar
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import archive  # noqa: E402
+import backfill  # noqa: E402
+
+
+class StubUM31:
+    """Monthly values of one meter, value is the month number"""
+
+    def iter_month_records(self, month):
+        yield OrderedDict([("meterUUID", "meter"), ("data", OrderedDict([("A+0", float(month))]))])
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.archive = archive.Archive(os.path.join(self.tmp.name, "archive"))
+        self.checkpoint_path = os.path.join(self.tmp.name, "backfill.json")
+
+    def tearDown(self):
+        self.archive.close()
+        self.tmp.cleanup()
+
+    def run_backfill(self, months):
+        return backfill.Backfill(StubUM31(), self.archive, self.checkpoint_path).run(months)
+
+    def test_older_months_after_newer_ones(self):
+        self.run_backfill(range(8, 11))
+        self.run_backfill(range(3, 6))
+        readings = self.archive.query("meter", "A+0")
+        expected = sorted((calendar.timegm(backfill.Backfill.month_start(month).timetuple()), float(month))
+                          for month in (3, 4, 5, 8, 9, 10))
+        self.assertEqual(readings, expected)
+        # Appending after insert continues the file
+        self.assertTrue(self.archive.append("meter", "A+0", expected[-1][0] + 1, 11.0))
+        self.assertEqual(len(self.archive.query("meter", "A+0")), 7)
+
+    def test_insert_replaces_same_timestamp(self):
+        self.archive.append("meter", "A+0", 200, 2.0)
+        self.assertTrue(self.archive.insert("meter", "A+0", 100, 1.0))
+        self.assertFalse(self.archive.insert("meter", "A+0", 100, 1.5))
+        self.assertEqual(self.archive.query("meter", "A+0"), [(100, 1.5), (200, 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+import restreamclient  # noqa: E402
+import fakebroker  # noqa: E402
+
+
+class PublishBatchTest(unittest.TestCase):
+    def setUp(self):
+        # Frequent thread switches make lock order problems between threads show up
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.broker = fakebroker.FakeBroker()
+        self.delivered = []
+        # Deadlocked network thread can't be stopped
+        self.stuck = False
+        self.client = restreamclient.RestreamClient("test", [], None, persistent=True, max_inflight=20)
+        self.client.on_delivered = self.delivered.append
+        self.client.start("127.0.0.1", port=self.broker.port)
+        deadline = time.monotonic() + 10
+        while not self.client.client.is_connected() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if not self.stuck:
+            self.client.stop()
+        self.broker.close()
+        sys.setswitchinterval(self.switch_interval)
+
+    def test_concurrent_publish_batch_while_acks_arrive(self):
+        # publish_batch() from another thread than the network thread delivering acknowledgements
+        count = 5000
+
+        def produce():
+            for i in range(count):
+                self.client.publish_batch([{"topic": "test", "payload": str(i), "qos": 1}])
+                # Yield so the window has room and publish() is called from this thread too
+                time.sleep(0)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        producer.join(30)
+        self.stuck = producer.is_alive()
+        self.assertFalse(self.stuck, "publish_batch blocked")
+        deadline = time.monotonic() + 30
+        while len(self.delivered) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.delivered), count)
+        self.assertEqual(self.client.pending(), 0)
+        # Messages are published in FIFO order
+        self.assertEqual([m["payload"] for m in self.delivered], [str(i) for i in range(count)])
+
+    def test_pending_until_delivered_returns(self):
+        # Spool is rewound when nothing is pending, acknowledged message must be recorded by then
+        pending = []
+        self.client.on_delivered = lambda m: pending.append(self.client.pending())
+        self.client.publish_batch([{"topic": "test", "payload": str(i), "qos": q} for i in range(50) for q in (0, 1)])
+        deadline = time.monotonic() + 30
+        while len(pending) < 100 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(pending), 100)
+        self.assertTrue(all(p >= 1 for p in pending))
+        self.assertEqual(self.client.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
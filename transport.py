@@ -0,0 +1,169 @@
+import time
+import select
+import socket
+import struct
+import threading
+import serial
+import metrics
+
+from serial.urlhandler import protocol_socket
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+    termios = None
+
+
+class SocketSerial(protocol_socket.Serial):
+    """socket:// connection reporting real number of waiting bytes where FIONREAD is available, for bulk reads"""
+
+    @property
+    def in_waiting(self):
+        if fcntl is None:
+            # No FIONREAD on non-POSIX hosts, pyserial reports 1 byte for readable socket
+            return super().in_waiting
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        readable, _, _ = select.select([self._socket], [], [], 0)
+        if not readable:
+            return 0
+        # Readable socket without data is closed by peer, read() of one byte reports it
+        return struct.unpack("i", fcntl.ioctl(self._socket, termios.FIONREAD, b"\0\0\0\0"))[0] or 1
+
+    def close(self):
+        # Without the 0.3 sec delay of pyserial for quick reconnects, gateways accept them
+        if self.is_open:
+            if self._socket:
+                try:
+                    self._socket.shutdown(socket.SHUT_RDWR)
+                    self._socket.close()
+                except OSError:
+                    pass
+                self._socket = None
+            self.is_open = False
+
+    def is_alive(self):
+        """Check that peer didn't close connection, without consuming data"""
+        if not self.is_open:
+            return False
+        readable, _, _ = select.select([self._socket], [], [], 0)
+        if not readable:
+            return True
+        try:
+            return self._socket.recv(1, socket.MSG_PEEK) != b""
+        except OSError:
+            return False
+
+
+def make_connection(port):
+    """Closed connection for serial port name or pyserial URL, e.g. socket://host:port or rfc2217://host:port
+
+    Args:
+        port (str): Serial port or URL.
+
+    Returns:
+        serial.SerialBase: The return value. Connection to open after setting parameters.
+
+    """
+    if port and port.startswith("socket://"):
+        connection = SocketSerial()
+    elif port and "://" in port:
+        return serial.serial_for_url(port, do_not_open=True)
+    else:
+        connection = serial.Serial()
+    connection.port = port
+    return connection
+
+
+def is_alive(connection):
+    """Cheap health check of open connection"""
+    if isinstance(connection, SocketSerial):
+        return connection.is_alive()
+    return connection.is_open
+
+
+class ConnectionPool:
+    """Open connections to serial ports and gateways reused between polls.
+
+    UM31.connect(pool=...) takes a connection from the pool and UM31.disconnect() returns it. Idle
+    connections are checked before reuse and reopened when closed by peer or idle for too long,
+    e.g. dropped by NAT of GSM/GPRS link. Thread-safe.
+
+    """
+
+    def __init__(self, max_idle=300):
+        """
+        Args:
+            max_idle (int): Time in seconds after which idle connection is reopened instead of reused.
+
+        """
+        self.max_idle = max_idle
+        self.__lock = threading.Lock()
+        # port -> list of (connection, time.monotonic() of release)
+        self.__idle = dict()
+
+    def acquire(self, port, baudrate=9600, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, timeout=15):
+        """Open connection to port, reused if possible.
+
+        Args:
+            port (str): Serial port or URL, see make_connection().
+            baudrate (int):
+            bytesize (serial):
+            parity (serial):
+            timeout (int): Read timeout in seconds.
+
+        Returns:
+            serial.SerialBase: The return value. Open connection, return it with release().
+
+        Raises:
+            serial.SerialException: Connection can't be opened.
+
+        """
+        while True:
+            with self.__lock:
+                idle = self.__idle.get(port)
+                if not idle:
+                    break
+                connection, released = idle.pop()
+            if time.monotonic() - released < self.max_idle and is_alive(connection):
+                connection.baudrate = baudrate
+                connection.bytesize = bytesize
+                connection.parity = parity
+                connection.timeout = timeout
+                return connection
+            connection.close()
+            metrics.inc("um31_reconnects_total", port=port)
+        connection = make_connection(port)
+        connection.baudrate = baudrate
+        connection.bytesize = bytesize
+        connection.parity = parity
+        connection.timeout = timeout
+        connection.open()
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return connection to the pool.
+
+        Args:
+            connection (serial.SerialBase): Connection from acquire().
+            discard (bool): Close connection instead, e.g. after timeout in the middle of response.
+
+        """
+        if not connection.is_open:
+            return
+        if discard:
+            connection.close()
+            return
+        with self.__lock:
+            self.__idle.setdefault(connection.port, []).append((connection, time.monotonic()))
+
+    def close(self):
+        """Close all idle connections"""
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = dict()
+        for connections in idle.values():
+            for connection, released in connections:
+                connection.close()
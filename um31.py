@@ -1,21 +1,142 @@
-import re
-import json
+import codecs
 import time
 import struct
 import serial
-import crcmod.predefined
-import uuidict
-
-from datetime import datetime, timedelta
+import metrics
+import transport
+import deviceclock
+import um31codec
+import meterregistry
+import batchcodec
+import meterjson
+
+from datetime import datetime
 from collections import OrderedDict
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class _Tokenizer:
+    """Single pass tokenizer of UM-31 payload.
+
+    Jumps between "=", "END" and "BL" markers with str.find() and copies every measurement once.
+    Removes CRC and open/close words ("END...BL"), the last close word ("END..." up to the end of data)
+    and splits measurements at "=" into fields at "<" with collapsed whitespace, skipping empty fields.
+    Text can be fed in chunks of any size.
+
+    """
+
+    def __init__(self):
+        self.__tail = ""
+        self.__pieces = []
+        self.__skipping = False
+        self.__skipped = 0
+        self.__first = True
+
+    def __fields(self, last):
+        text = "".join(self.__pieces)
+        self.__pieces = []
+        # Whitespace is collapsed over the whole payload, so only its very start and end are stripped
+        collapsed = " ".join(text.split())
+        if collapsed:
+            if not self.__first and text[0].isspace():
+                collapsed = " " + collapsed
+            if not last and text[-1].isspace():
+                collapsed += " "
+        self.__first = False
+        return [field for field in collapsed.split("<") if field and field != " "]
+
+    def feed(self, text):
+        """Tokenize next chunk of text.
+
+        Args:
+            text (str): Next chunk of decoded payload.
+
+        Returns:
+            list of lists of str: Measurements closed by "=" in this chunk.
+
+        """
+        buf = self.__tail + text if self.__tail else text
+        size = len(buf)
+        pos = 0
+        sep_pos = end_pos = -2
+        measurements = []
+        while True:
+            if self.__skipping:
+                bl_pos = buf.find("BL", pos)
+                if bl_pos < 0:
+                    # Keep the last char, it can be the beginning of "BL"
+                    keep = max(pos, size - 1)
+                    self.__skipped += keep - pos
+                    pos = keep
+                    break
+                self.__pieces.append(" ")
+                pos = bl_pos + 2
+                self.__skipping = False
+                continue
+            if -1 < sep_pos < pos or sep_pos == -2:
+                sep_pos = buf.find("=", pos)
+            if -1 < end_pos < pos or end_pos == -2:
+                end_pos = buf.find("END", pos)
+            if sep_pos >= 0 and (end_pos < 0 or sep_pos < end_pos):
+                self.__pieces.append(buf[pos:sep_pos])
+                measurements.append(self.__fields(False))
+                pos = sep_pos + 1
+            elif end_pos >= 0:
+                self.__pieces.append(buf[pos:end_pos])
+                pos = end_pos + 3
+                self.__skipping = True
+                self.__skipped = 0
+            else:
+                # Keep two last chars, they can be the beginning of "END"
+                keep = max(pos, size - 2)
+                self.__pieces.append(buf[pos:keep])
+                pos = keep
+                break
+        self.__tail = buf[pos:]
+        return measurements
+
+    def close(self):
+        """Finish tokenizing.
+
+        Returns:
+            list of str: The last measurement.
+
+        """
+        if self.__skipping:
+            # Last close word is removed only if something follows it
+            if not self.__skipped and not self.__tail:
+                self.__pieces.append("END")
+        else:
+            self.__pieces.append(self.__tail)
+        self.__tail = ""
+        return self.__fields(True)
+
 
 class UM31:
     """Class for connection and reading information from UM-31GSM Device"""
 
     def __init__(self):
         self.__password = '00000000'
+        self.__deadline = 120
+        self.__crc = "modbus"
+        self.__crc_check = False
+        self.__retries = 2
         self.__connection = serial.Serial()
+        # Port given to the last connect(), kept after disconnect() for metric labels of exports
+        self.__port = None
+        self.__pool = None
+        # Connection timed out in the middle of response and can't be reused
+        self.__broken = False
+        # perf_counter() of the last command write, start of first byte and read timings
+        self.__write_time = 0.0
+        self.__sync_clock = False
+        self.__clock = deviceclock.DeviceClock()
+        # (port, utc_offset, tz) -> DeviceClock, measured offsets are kept over reconnects
+        self.__clocks = dict()
 
     def connect(self,
                 port=None,
@@ -23,34 +144,77 @@ class UM31:
                 bytesize=serial.EIGHTBITS,
                 parity=serial.PARITY_NONE,
                 password='00000000',
-                timeout=15):
+                timeout=15,
+                deadline=120,
+                crc="modbus",
+                crc_check=False,
+                retries=2,
+                pool=None,
+                sync_clock=True,
+                utc_offset=3,
+                tz=None):
         """Connect to UM-31 with specified serial port parameters
 
         Args:
-            port (str):
+            port (str): Serial port or pyserial URL, e.g. socket://host:port or rfc2217://host:port.
             baudrate (int):
             bytesize (serial):
             parity (serial):
             password (str):
-            timeout (int):
+            timeout (int): Max silence in seconds while waiting for response bytes.
+            deadline (int): Max time in seconds for the whole response of one command.
+            crc (str): CRC variant of device firmware, key of um31codec.CRC_FUNCTIONS.
+            crc_check (bool): Verify CRC of response frames, see um31codec.verify_response().
+            retries (int): Number of command repeats when response has CRC errors.
+            pool (transport.ConnectionPool): Take open connection from pool, disconnect() returns it back.
+            sync_clock (bool): Measure device clock offset with GETDATETIME before reading current values,
+                see sync_clock().
+            utc_offset (float): Hours between device clock and UTC, used until the offset is measured.
+            tz (str or tzinfo): Time zone of device clock for DST aware conversion, see deviceclock.DeviceClock.
 
         """
         self.__password = password
-        self.__connection.port = port
-        self.__connection.baudrate = baudrate
-        self.__connection.bytesize = bytesize
-        self.__connection.parity = parity
-        self.__connection.timeout = timeout
+        self.__deadline = deadline
+        self.__crc = crc
+        self.__crc_check = crc_check
+        self.__retries = retries
+        self.__sync_clock = sync_clock
+        clock_key = (port, utc_offset, tz)
+        if clock_key not in self.__clocks:
+            self.__clocks[clock_key] = deviceclock.DeviceClock(utc_offset, tz)
+        self.__clock = self.__clocks[clock_key]
+        self.disconnect()
+        self.__port = port
+        self.__broken = False
         try:
-            self.__connection.close()
-            self.__connection.open()
+            with metrics.timer("um31_stage_seconds", stage="serial_open", port=port):
+                if pool is not None:
+                    self.__connection = pool.acquire(port, baudrate, bytesize, parity, timeout)
+                    self.__pool = pool
+                else:
+                    self.__connection = transport.make_connection(port)
+                    self.__connection.baudrate = baudrate
+                    self.__connection.bytesize = bytesize
+                    self.__connection.parity = parity
+                    self.__connection.timeout = timeout
+                    self.__connection.open()
             print("Connected to", port, "at", time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
         except serial.SerialException:
             print("Can't open connection")
 
     def disconnect(self):
-        """Disconnect from UM-31 immediately"""
-        self.__connection.close()
+        """Disconnect from UM-31 immediately, or return connection to pool given to connect()"""
+        if self.__pool is not None:
+            self.__pool.release(self.__connection, discard=self.__broken)
+            self.__pool = None
+            self.__connection = serial.Serial()
+        else:
+            self.__connection.close()
+
+    def abort(self):
+        """Close connection from another thread to interrupt a hung read, pooled connection is discarded"""
+        self.__broken = True
+        self.disconnect()
 
     def __pack_command(self, cmd_word):
         """Internal function for packing command in desirable format.
@@ -62,29 +226,212 @@ class UM31:
             bytes: The return value. Formatted command to write in UM-31.
 
         """
-        crc_func = crcmod.predefined.mkCrcFun('modbus')
-        sep = ","
+        return um31codec.pack_command(self.__password, cmd_word, self.__crc)
+
+    def __read_chunks(self):
+        """Internal generator yielding response bytes as soon as they arrive.
+
+        Reads everything waiting in the input buffer at once, blocks only for the first byte of a chunk.
 
-        cmd_text = self.__password + sep + cmd_word
-        crc = crc_func(cmd_text.encode('utf-8'))
-        packed_cmd = cmd_text + format(crc, 'x') + "\x0A\x0A"
-        # print(packed_cmd.encode("utf-8"))
-        return packed_cmd.encode("utf-8")
+        Raises:
+            serial.SerialTimeoutException: Device was silent for timeout or the whole response exceeded deadline.
+
+        """
+        connection = self.__connection
+        timeout = connection.timeout
+        deadline = time.monotonic() + self.__deadline
+        first = True
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.__broken = True
+                    metrics.inc("um31_timeouts_total", port=self.__port)
+                    raise serial.SerialTimeoutException("No end of response in " + str(self.__deadline) + " sec")
+                if timeout is None or remaining < timeout:
+                    connection.timeout = remaining
+                chunk = connection.read(connection.in_waiting or 1)
+                if not chunk:
+                    if deadline - time.monotonic() > 0:
+                        self.__broken = True
+                        metrics.inc("um31_timeouts_total", port=self.__port)
+                        raise serial.SerialTimeoutException("No response in " + str(timeout) + " sec")
+                    continue
+                if first:
+                    first = False
+                    metrics.observe("um31_stage_seconds", time.perf_counter() - self.__write_time,
+                                    stage="first_byte", port=self.__port)
+                yield chunk
+        finally:
+            if connection.timeout != timeout:
+                connection.timeout = timeout
+
+    def __write_cmd(self, cmd_word):
+        with metrics.timer("um31_stage_seconds", stage="command_write", port=self.__port):
+            self.__connection.reset_input_buffer()
+            self.__connection.write(self.__pack_command(cmd_word))
+        self.__write_time = time.perf_counter()
 
     def __execute_cmd(self, cmd_word, stop_word):
-        stop_word = stop_word.encode("utf-8")
-        cmd = self.__pack_command(cmd_word)
-        self.__connection.write(cmd)
-        time.sleep(1)
-        data = cmd_word.encode("utf-8")
-        while True:
-            current_line = self.__connection.readline()
-            # print(current_line)
-            if stop_word not in current_line:
-                data += current_line
+        """Internal function for command execution.
+
+        Args:
+            cmd_word (str): Supported command from documentation.
+            stop_word (str): Response is complete when a line containing stop_word is received.
+
+        Returns:
+            bytes: The return value. cmd_word followed by response lines before the stop_word line.
+
+        Raises:
+            um31codec.CRCError: Response frames are corrupted in all attempts, only with crc_check.
+
+        """
+        data, stop_pos = self.__read_response(cmd_word, stop_word)
+        if self.__crc_check:
+            # The last frame is closed in the stop word line, so it is verified before the line is dropped
+            for attempt in range(self.__retries):
+                errors = um31codec.verify_response(data, self.__crc)
+                if not errors:
+                    break
+                metrics.inc("um31_crc_errors_total", port=self.__port)
+                print("CRC error in", len(errors), "frames of", cmd_word, "response, repeating")
+                data, stop_pos = self.__read_response(cmd_word, stop_word)
             else:
-                break
-        return data
+                errors = um31codec.verify_response(data, self.__crc)
+                if errors:
+                    metrics.inc("um31_crc_errors_total", port=self.__port)
+                    raise um31codec.CRCError(errors)
+        # Drop the whole line containing stop word
+        return data[:data.rfind(b"\n", 0, stop_pos) + 1]
+
+    def __read_response(self, cmd_word, stop_word):
+        """Internal function reading response up to the stop word, or the end of its line with crc_check.
+
+        Returns:
+            tuple: (data, stop_pos), cmd_word followed by response and position of stop_word in it.
+
+        """
+        stop_word = stop_word.encode("utf-8")
+        self.__write_cmd(cmd_word)
+        data = bytearray(cmd_word.encode("utf-8"))
+        # Search only new bytes, keeping overlap for the stop word split between chunks
+        search_from = len(data)
+        stop_pos = -1
+        chunks = self.__read_chunks()
+        try:
+            for chunk in chunks:
+                data += chunk
+                if stop_pos < 0:
+                    stop_pos = data.find(stop_word, max(search_from - len(stop_word) + 1, 0))
+                    search_from = len(data)
+                if stop_pos < 0:
+                    continue
+                # The stop word line ends with CRC of the last frame, needed only for verification
+                line_end = data.find(b"\n", stop_pos)
+                if line_end >= 0:
+                    del data[line_end + 1:]
+                    break
+                if not self.__crc_check:
+                    break
+                # CRC is complete after 4 hex digits or at the first other byte, e.g. "\r"
+                crc_text = data[stop_pos + len(stop_word):]
+                if len(crc_text) >= 4 or any(byte not in um31codec.HEX_DIGITS for byte in crc_text):
+                    break
+        except serial.SerialTimeoutException:
+            if stop_pos < 0:
+                raise
+            # Stop word line without line end, CRC digits received so far are verified
+            self.__broken = False
+        finally:
+            chunks.close()
+        metrics.observe("um31_stage_seconds", time.perf_counter() - self.__write_time,
+                        stage="read", port=self.__port)
+        return bytes(data), stop_pos
+
+    def __iter_lines(self, cmd_word, stop_word):
+        """Internal generator for command execution with streaming output.
+
+        With crc_check lines of every CRC frame are yielded after the frame is received and verified.
+
+        Args:
+            cmd_word (str): Supported command from documentation.
+            stop_word (str): Response is complete when a line containing stop_word is received.
+
+        Yields:
+            bytes: Response lines before the stop_word line, the first one is prefixed with cmd_word.
+
+        Raises:
+            um31codec.CRCError: Frame is corrupted, only with crc_check. Lines of previous frames are already yielded.
+
+        """
+        stop_word = stop_word.encode("utf-8")
+        self.__write_cmd(cmd_word)
+        line = bytearray(cmd_word.encode("utf-8"))
+        # Lines of CRC frame which is not verified yet
+        frame = []
+        chunks = self.__read_chunks()
+        try:
+            try:
+                for chunk in chunks:
+                    line += chunk
+                    line_end = line.find(b"\n")
+                    while line_end >= 0:
+                        stop = stop_word in line[:line_end]
+                        yield from self.__frame_lines(frame, bytes(line[:line_end + 1]), stop)
+                        if stop:
+                            return
+                        del line[:line_end + 1]
+                        line_end = line.find(b"\n")
+                    stop_pos = line.find(stop_word)
+                    if stop_pos >= 0:
+                        if not self.__crc_check:
+                            return
+                        # CRC is complete after 4 hex digits or at the first other byte, e.g. "\r"
+                        crc_text = line[stop_pos + len(stop_word):]
+                        if len(crc_text) >= 4 or any(byte not in um31codec.HEX_DIGITS for byte in crc_text):
+                            break
+            except serial.SerialTimeoutException:
+                if not self.__crc_check or stop_word not in line:
+                    raise
+                # Stop word line without line end, CRC digits received so far are verified
+                self.__broken = False
+            yield from self.__frame_lines(frame, bytes(line), True)
+        finally:
+            chunks.close()
+
+    def __frame_lines(self, frame, line, stop):
+        """Internal generator of lines to yield after line is received.
+
+        Args:
+            frame (list): Lines of current CRC frame, emptied when the frame is complete.
+            line (bytes): Received line.
+            stop (bool): Line contains stop word, it is not yielded.
+
+        Yields:
+            bytes: The line itself, or with crc_check all lines of the frame closed by it.
+
+        Raises:
+            um31codec.CRCError: Frame closed by line is corrupted, only with crc_check.
+
+        """
+        if not self.__crc_check:
+            if not stop:
+                yield line
+            return
+        frame.append(line)
+        if not stop and b"END" not in line:
+            return
+        data = b"".join(frame)
+        errors = um31codec.verify_response(data, self.__crc)
+        if not errors and next(um31codec.iter_frames(data), None) is None:
+            # Frame start is corrupted
+            errors = [um31codec.FrameError(0, 0, len(data), None, None)]
+        if errors:
+            metrics.inc("um31_crc_errors_total", port=self.__port)
+            raise um31codec.CRCError(errors)
+        lines = frame[:-1] if stop else frame[:]
+        del frame[:]
+        yield from lines
 
     def read_current_values(self):
         """Read current values.
@@ -93,6 +440,8 @@ class UM31:
             str: The return value. Unformatted payload from UM-31.
 
         """
+        if self.__sync_clock:
+            self.sync_clock()
         return self.__execute_cmd("READCURR", "READCURREND")
 
     def read_month_values(self, month):
@@ -107,6 +456,29 @@ class UM31:
         """
         return self.__execute_cmd("READMONTH=" + format(month, "02d"), "READMONTHEND")
 
+    def iter_current_records(self):
+        """Read current values, yielding every meter as soon as its data is received.
+
+        Yields:
+            OrderedDict: Meter record, the same as export_json() item before JSON encoding.
+
+        """
+        if self.__sync_clock:
+            self.sync_clock()
+        return self.__iter_stream_records("READCURR", "READCURREND")
+
+    def iter_month_records(self, month):
+        """Read values for selected month, yielding every meter as soon as its data is received.
+
+        Args:
+            month (int): Month to read values for, should be in range(1..12).
+
+        Yields:
+            OrderedDict: Meter record, the same as export_json() item before JSON encoding.
+
+        """
+        return self.__iter_stream_records("READMONTH=" + format(month, "02d"), "READMONTHEND")
+
     def read_diagnostic(self):
         """Read diagnostic data.
 
@@ -116,16 +488,70 @@ class UM31:
         """
         return self.__execute_cmd("RDIAGN", "END")
 
+    def probe(self):
+        """Cheap health check before full reads, see is_healthy().
+
+        RDIAGN response is one short line per meter, without channel values. Its format is assumed, see
+        export_diagnostic(), so a response which can't be parsed gives a diagnostic of unknown health
+        instead of an unhealthy one.
+
+        Returns:
+            OrderedDict: The return value. Parsed diagnostic, see export_diagnostic(), None if device didn't answer.
+
+        """
+        try:
+            data = self.read_diagnostic()
+        except serial.SerialException as e:
+            print("No diagnostic from", str(self.__port) + ":", e)
+            return None
+        if not data:
+            return None
+        try:
+            return self.export_diagnostic(data)
+        except (KeyError, IndexError, ValueError) as e:
+            print("Can't parse diagnostic from", str(self.__port) + ":", repr(e))
+            return OrderedDict([("state", None), ("time", None), ("gsm", None),
+                                ("buses", OrderedDict()), ("meters", [])])
+
     def read_ntpserver_list(self, record_num):
         return self.__execute_cmd(" RNTPSRV=" + str(record_num), "None")
 
     def read_time(self):
-        cmd_word = "GETDATETIME"
-        cmd = self.__pack_command(cmd_word)
-        self.__connection.write(cmd)
-        time.sleep(1)
-        data = self.__connection.readline() + self.__connection.readline()
-        return data
+        self.__write_cmd("GETDATETIME")
+        data = bytearray()
+        chunks = self.__read_chunks()
+        try:
+            for chunk in chunks:
+                data += chunk
+                if data.count(b"\n") >= 2:
+                    # Response is two lines long
+                    del data[data.find(b"\n", data.find(b"\n") + 1) + 1:]
+                    return bytes(data)
+        finally:
+            chunks.close()
+
+    def sync_clock(self):
+        """Measure offset of device clock from UTC with GETDATETIME, if the last measurement is too old.
+
+        Offset is used to convert row timestamps to UTC. If device doesn't answer, the previous or default
+        offset is kept until the next attempt after max_age of deviceclock.DeviceClock.
+
+        Returns:
+            float: The return value. Seconds device clock is ahead of UTC, or of its time zone if tz is set.
+
+        """
+        if not self.__clock.expired():
+            return self.__clock.offset
+        sent = time.time()
+        try:
+            data = self.read_time()
+            received = time.time()
+            pos = data.find(b"=") + 1
+            self.__clock.measure(data[pos:pos + 19].decode("ascii"), (sent + received) / 2)
+        except (serial.SerialException, AttributeError, UnicodeDecodeError, ValueError) as e:
+            print("Can't read clock of", str(self.__port) + ":", e)
+            self.__clock.failed()
+        return self.__clock.offset
 
     # noinspection PyMethodMayBeStatic
     def _clean_data(self, data):
@@ -135,90 +561,108 @@ class UM31:
             data (bytearray): Raw rows from UM-31
 
         Returns:
-            inter5[0][0] (str): Key raw to determine which command was used to read the data
-            inter5[2:] (list of lists of str): cleaned data separated by TAG (TD, SNUM, etc..)
+            key (str): Key raw to determine which command was used to read the data
+            rows (list of lists of str): cleaned data separated by TAG (TD, SNUM, etc..)
 
         """
-        inter0 = data.decode("utf-8", "ignore")
-        if inter0.startswith("READ"):
-            # Remove whitespaces
-            inter1 = re.sub(r"[\s]", " ", inter0)
-            # Remove CRC and open/close words
-            inter2 = re.sub(r"END(.*?)BL", " ", inter1)
-            # Remove last close word
-            inter3 = re.sub(r"END.+", "", inter2)
-            # Split to separate measurements at "=" sign
-            inter4 = re.split("=", " ".join(inter3.split()))
-            inter5 = []
-            # Split each measurement in to list of measurement fields at "<" sign, remove empty fields
-            for i in inter4:
-                inter5.append(list(filter(lambda elem: elem.strip(), re.split("<", i))))
-            return inter5[0][0], inter5[2:]
-        else:
-            return None
+        with metrics.timer("um31_stage_seconds", stage="clean_data", port=self.__port):
+            text = data.decode("utf-8", "ignore")
+            if text.startswith("READ"):
+                tokenizer = _Tokenizer()
+                measurements = tokenizer.feed(text)
+                measurements.append(tokenizer.close())
+                return measurements[0][0], measurements[2:]
+            else:
+                return None
 
-    def export_json(self, data):
+    # noinspection PyMethodMayBeStatic
+    def _iter_clean_data(self, lines):
+        """Clean output data incrementally, the same way as _clean_data
 
-        def _parse_description(id_block, sn_block):
-            serial_number_ = sn_block.split()[1]
-            meter_descr = id_block.split()[1]
-            meter_descr = meter_descr.split(";")
-            dev_index = format(int(meter_descr[3]), "02d")
-            device_ = self.__dev_dict[dev_index]
-            int_code_ = format(int(meter_descr[0]), "04d") + "/" + format(int(meter_descr[1]), "04d")
-            bus_ = self.__bus_dict[meter_descr[2]]
-            return device_, serial_number_, int_code_, bus_
-
-        def _description_string(device_, serial_number_, int_code_, bus_):
-            meter_descr = device_ \
-                          + ", ID=" + int_code_ \
-                          + ", S/N=" + serial_number_ \
-                          + ", bus=" + bus_
-            return meter_descr
+        Args:
+            lines (iterable of bytes): Raw rows from UM-31
 
-        key, data = self._clean_data(data)
-        time_format = "%Y-%m-%dT%H:%M:%SZ"
-        json_list = []
-        data_dict = OrderedDict([("_spec", "electricity_meter")])
-        full_dict = OrderedDict([("meterUUID", None),
-                                 ("meterDescription", None),
-                                 ("transmittedAt", None),
-                                 ("data", None)])
-        info_dict = OrderedDict()
-        uuid_dict = uuidict.UUIDict("um31.uuid")
+        Yields:
+            list of str: Measurement fields, as soon as the measurement is closed by "=" or by the end of data.
+                The first one is the key measurement.
+
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")("ignore")
+        tokenizer = _Tokenizer()
+        for line in lines:
+            yield from tokenizer.feed(decoder.decode(line))
+        yield from tokenizer.feed(decoder.decode(b"", final=True))
+        yield tokenizer.close()
+
+    def __parse_meter(self, id_block, sn_block):
+        """Internal function for meter identity, see meterregistry.MeterRegistry.lookup()
+
+        Args:
+            id_block (str): "ID a;b;bus;dev" block of row.
+            sn_block (str): "SNUM nnnnnnnn" block of row.
+
+        Returns:
+            tuple: (device, serial_number, int_code, bus, description)
+
+        """
+        serial_number = sn_block.split()[1]
+        meter_descr = id_block.split()[1]
+        meter_descr = meter_descr.split(";")
+        dev_index = format(int(meter_descr[3]), "02d")
+        device = self.__dev_dict[dev_index]
+        int_code = format(int(meter_descr[0]), "04d") + "/" + format(int(meter_descr[1]), "04d")
+        bus = self.__bus_dict[meter_descr[2]]
+        description = device \
+            + ", ID=" + int_code \
+            + ", S/N=" + serial_number \
+            + ", bus=" + bus
+        return device, serial_number, int_code, bus, description
+
+    def _iter_records(self, key, data):
+        """Format cleaned data as meter records
+
+        Args:
+            key (str): Key raw to determine which command was used to read the data
+            data (iterable of lists of str): cleaned data separated by TAG (TD, SNUM, etc..)
+
+        Yields:
+            OrderedDict: Meter record with meterUUID, meterDescription, transmittedAt and data
+
+        """
+
+        def _record(transmitted_at_, id_block, sn_block, values):
+            start = time.perf_counter()
+            meter = registry.lookup(id_block, sn_block, self.__parse_meter)
+            metrics.observe("um31_stage_seconds", time.perf_counter() - start, stage="uuid_lookup", port=port)
+            # Format values
+            data_dict = OrderedDict([("_spec", "electricity_meter")])
+            for val in values:
+                val = val.split()
+                data_dict[val[0]] = round(float(val[1]), 1)
+            info_dict = OrderedDict([("DEV", meter.device), ("SNUM", meter.serial_number), ("INT_ID", meter.int_code),
+                                     ("BUS", meter.bus)])
+            data_dict.update({"info": info_dict})
+            return OrderedDict([("meterUUID", meter.uuid),
+                                ("meterDescription", meter.description),
+                                ("transmittedAt", transmitted_at_),
+                                ("data", data_dict)])
+
+        clock = self.__clock
+        port = self.__port
+        # Loaded once per process, reloaded only if UUIDs were changed by another process
+        registry = meterregistry.get_registry("um31.uuid")
+        registry.check()
         if key.startswith("READCURR"):
             for row in data:
                 if len(row) > 2:
                     # Format time
                     splited_time_row = row[0].split()
-                    transmitted_at = splited_time_row[1] + splited_time_row[2]
                     # Check if time is synced
                     if splited_time_row[3] == "2":
-                        transmitted_at = datetime.strptime(transmitted_at, "%d.%m.%Y%H:%M:%S")
-                        try:
-                            # h_offset = -time.localtime().tm_gmtoff
-                            h_offset = -3
-                        except:
-                            h_offset = -3
-                        time_delta = timedelta(hours=h_offset)
-                        transmitted_at = transmitted_at + time_delta
-                        transmitted_at = datetime.strftime(transmitted_at, time_format)
+                        transmitted_at = clock.utc(splited_time_row[1] + " " + splited_time_row[2]) + "Z"
                     else:
-                        transmitted_at = datetime.utcnow().strftime(time_format)
-                    # Format meterDescription
-                    device, serial_number, int_code, bus = _parse_description(row[1], row[2])
-                    meter_description = _description_string(device, serial_number, int_code, bus)
-                    # Format values
-                    for val in row[3:]:
-                        val = val.split()
-                        data_dict[val[0]] = round(float(val[1]), 1)
-                    info_dict.update({"DEV": device, "SNUM": serial_number, "INT_ID": int_code, "BUS": bus})
-                    data_dict.update({"info": info_dict})
-                    full_dict.update({"meterUUID": uuid_dict.get_uuid(meter_description),
-                                      "meterDescription": meter_description,
-                                      "transmittedAt": transmitted_at,
-                                      "data": data_dict})
-                    json_list.append(json.dumps(full_dict, indent=4))
+                        transmitted_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                    yield _record(transmitted_at, row[1], row[2], row[3:])
                 else:
                     pass
 
@@ -226,81 +670,212 @@ class UM31:
             for row in data:
                 if len(row) > 1:
                     # Format time
-                    transmitted_at = datetime.utcnow().strftime(time_format)
-                    device, serial_number, int_code, bus = _parse_description(row[0], row[1])
-                    meter_description = _description_string(device, serial_number, int_code, bus)
-                    # Format values
-                    for val in row[2:]:
-                        val = val.split()
-                        data_dict[val[0]] = round(float(val[1]), 1)
-                    info_dict.update({"DEV": device, "SNUM": serial_number, "INT_ID": int_code, "BUS": bus})
-                    data_dict.update({"info": info_dict})
-                    full_dict.update({"meterUUID": uuid_dict.get_uuid(meter_description),
-                                      "meterDescription": meter_description,
-                                      "transmittedAt": transmitted_at,
-                                      "data": data_dict})
-                    json_list.append(json.dumps(full_dict, indent=4))
+                    transmitted_at = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                    yield _record(transmitted_at, row[0], row[1], row[2:])
                 else:
                     pass
         else:
             pass
 
-        return json_list
-
-    # def __custom_crc(self, init_crc=0xFFFF):
-    #     # ~ Table of CRC values for high–order byte
-    #     auchCRCHi = [
-    #         0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81,
-    #         0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
-    #         0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01,
-    #         0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41,
-    #         0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81,
-    #         0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0,
-    #         0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01,
-    #         0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40,
-    #         0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81,
-    #         0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
-    #         0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01,
-    #         0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
-    #         0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81,
-    #         0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0,
-    #         0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01,
-    #         0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81, 0x40, 0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41,
-    #         0x00, 0xC1, 0x81, 0x40, 0x01, 0xC0, 0x80, 0x41, 0x01, 0xC0, 0x80, 0x41, 0x00, 0xC1, 0x81,
-    #         0x40]
-    #
-    #     # ~ Table of CRC values for low–order byte
-    #     auchCRCLo = [
-    #         0x00, 0xC0, 0xC1, 0x01, 0xC3, 0x03, 0x02, 0xC2, 0xC6, 0x06, 0x07, 0xC7, 0x05, 0xC5, 0xC4,
-    #         0x04, 0xCC, 0x0C, 0x0D, 0xCD, 0x0F, 0xCF, 0xCE, 0x0E, 0x0A, 0xCA, 0xCB, 0x0B, 0xC9, 0x09,
-    #         0x08, 0xC8, 0xD8, 0x18, 0x19, 0xD9, 0x1B, 0xDB, 0xDA, 0x1A, 0x1E, 0xDE, 0xDF, 0x1F, 0xDD,
-    #         0x1D, 0x1C, 0xDC, 0x14, 0xD4, 0xD5, 0x15, 0xD7, 0x17, 0x16, 0xD6, 0xD2, 0x12, 0x13, 0xD3,
-    #         0x11, 0xD1, 0xD0, 0x10, 0xF0, 0x30, 0x31, 0xF1, 0x33, 0xF3, 0xF2, 0x32, 0x36, 0xF6, 0xF7,
-    #         0x37, 0xF5, 0x35, 0x34, 0xF4, 0x3C, 0xFC, 0xFD, 0x3D, 0xFF, 0x3F, 0x3E, 0xFE, 0xFA, 0x3A,
-    #         0x3B, 0xFB, 0x39, 0xF9, 0xF8, 0x38, 0x28, 0xE8, 0xE9, 0x29, 0xEB, 0x2B, 0x2A, 0xEA, 0xEE,
-    #         0x2E, 0x2F, 0xEF, 0x2D, 0xED, 0xEC, 0x2C, 0xE4, 0x24, 0x25, 0xE5, 0x27, 0xE7, 0xE6, 0x26,
-    #         0x22, 0xE2, 0xE3, 0x23, 0xE1, 0x21, 0x20, 0xE0, 0xA0, 0x60, 0x61, 0xA1, 0x63, 0xA3, 0xA2,
-    #         0x62, 0x66, 0xA6, 0xA7, 0x67, 0xA5, 0x65, 0x64, 0xA4, 0x6C, 0xAC, 0xAD, 0x6D, 0xAF, 0x6F,
-    #         0x6E, 0xAE, 0xAA, 0x6A, 0x6B, 0xAB, 0x69, 0xA9, 0xA8, 0x68, 0x78, 0xB8, 0xB9, 0x79, 0xBB,
-    #         0x7B, 0x7A, 0xBA, 0xBE, 0x7E, 0x7F, 0xBF, 0x7D, 0xBD, 0xBC, 0x7C, 0xB4, 0x74, 0x75, 0xB5,
-    #         0x77, 0xB7, 0xB6, 0x76, 0x72, 0xB2, 0xB3, 0x73, 0xB1, 0x71, 0x70, 0xB0, 0x50, 0x90, 0x91,
-    #         0x51, 0x93, 0x53, 0x52, 0x92, 0x96, 0x56, 0x57, 0x97, 0x55, 0x95, 0x94, 0x54, 0x9C, 0x5C,
-    #         0x5D, 0x9D, 0x5F, 0x9F, 0x9E, 0x5E, 0x5A, 0x9A, 0x9B, 0x5B, 0x99, 0x59, 0x58, 0x98, 0x88,
-    #         0x48, 0x49, 0x89, 0x4B, 0x8B, 0x8A, 0x4A, 0x4E, 0x8E, 0x8F, 0x4F, 0x8D, 0x4D, 0x4C, 0x8C,
-    #         0x44, 0x84, 0x85, 0x45, 0x87, 0x47, 0x46, 0x86, 0x82, 0x42, 0x43, 0x83, 0x41, 0x81, 0x80,
-    #         0x40]
-    #
-    #     ##########################################################################
-    #
-    #     uchCRCHi = 0xFF  # high byte of CRC initialized
-    #     uchCRCLo = 0xFF  # low byte of CRC initialized
-    #     uIndex = 0x0000  # will index into CRC lookup table
-    #
-    #     for ch in data:
-    #         uIndex = uchCRCLo ^ ord(ch)
-    #         uchCRCLo = uchCRCHi ^ auchCRCHi[uIndex]
-    #         uchCRCHi = auchCRCLo[uIndex]
-    #     return (uchCRCHi << 8 | uchCRCLo)
+    def __iter_stream_records(self, cmd_word, stop_word):
+        measurements = self._iter_clean_data(self.__iter_lines(cmd_word, stop_word))
+        try:
+            key = next(measurements)[0]
+            # The second measurement is skipped, the same as in _clean_data
+            next(measurements, None)
+            yield from self._iter_records(key, measurements)
+        finally:
+            measurements.close()
+
+    def export_records(self, data):
+        """Format payload as meter records
+
+        Args:
+            data (bytes): Unformatted payload from UM-31
+
+        Returns:
+            list of OrderedDict: The return value. Meter records.
+
+        """
+        key, data = self._clean_data(data)
+        return list(self._iter_records(key, data))
+
+    def export_json(self, data):
+        """Format payload as JSON strings, one for each meter
+
+        Args:
+            data (bytes): Unformatted payload from UM-31
+
+        Returns:
+            list of str: The return value. JSON strings of meter records.
+
+        """
+        records = self.export_records(data)
+        with metrics.timer("um31_stage_seconds", stage="json_encode", port=self.__port):
+            return [self.__serializer.dumps(record) for record in records]
+
+    def export_batch(self, data, encoding="json", compress=False):
+        """Format payload as one compact document for all meters, see batchcodec.encode_batch()
+
+        Args:
+            data (bytes): Unformatted payload from UM-31
+            encoding (str): One of "json", "msgpack" or "cbor".
+            compress (bool): Compress document with zlib.
+
+        Returns:
+            bytes: The return value. Encoded document, decoded with batchcodec.decode_batch().
+
+        """
+        return batchcodec.encode_batch(self.export_records(data), encoding, compress)
+
+    def export_columns(self, data):
+        """Decode payload into NumPy arrays, one element per channel value of every meter
+
+        Values are converted in bulk and are not rounded, unlike export_records(). Timestamps are
+        transmittedAt in UTC: device time for synced READCURR rows, time of decoding otherwise.
+
+        Args:
+            data (bytes): Unformatted payload from UM-31
+
+        Returns:
+            OrderedDict: The return value. "meter" (int32 index in "meters"), "channel" (int16 index in
+                "channels"), "value" (float64) and "timestamp" (datetime64[s]) arrays of equal length;
+                "meters" list of meterregistry.MeterInfo and "channels" list of channel names.
+
+        Raises:
+            ImportError: NumPy is not installed.
+
+        """
+        if numpy is None:
+            raise ImportError("numpy is not installed")
+        key, rows = self._clean_data(data)
+        if key.startswith("READCURR"):
+            first = 3
+        elif key.startswith("READMONTH"):
+            first = 2
+        else:
+            first = None
+        registry = meterregistry.get_registry("um31.uuid")
+        registry.check()
+        meters = []
+        meter_indexes = dict()
+        channels = []
+        channel_indexes = dict()
+        row_meters = []
+        row_sizes = []
+        row_times = []
+        channel_codes = []
+        value_texts = []
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+        for row in rows if first else ():
+            if len(row) < first:
+                continue
+            meter = registry.lookup(row[first - 2], row[first - 1], self.__parse_meter)
+            try:
+                row_meters.append(meter_indexes[meter.uuid])
+            except KeyError:
+                row_meters.append(meter_indexes.setdefault(meter.uuid, len(meters)))
+                meters.append(meter)
+            td = row[0].split() if first == 3 else None
+            if td and td[3] == "2":
+                row_times.append(self.__clock.utc(td[1] + " " + td[2]))
+            else:
+                row_times.append(now)
+            row_sizes.append(len(row) - first)
+            for val in row[first:]:
+                val = val.split()
+                try:
+                    channel_codes.append(channel_indexes[val[0]])
+                except KeyError:
+                    channel_codes.append(channel_indexes.setdefault(val[0], len(channels)))
+                    channels.append(val[0])
+                value_texts.append(val[1])
+
+        timestamps = numpy.array(row_times, dtype="datetime64[s]")
+        row_sizes = numpy.array(row_sizes, dtype=numpy.intp)
+        return OrderedDict([("meter", numpy.repeat(numpy.array(row_meters, dtype=numpy.int32), row_sizes)),
+                            ("channel", numpy.array(channel_codes, dtype=numpy.int16)),
+                            ("value", numpy.array(value_texts, dtype=numpy.float64)),
+                            ("timestamp", numpy.repeat(timestamps, row_sizes)),
+                            ("meters", meters),
+                            ("channels", channels)])
+
+    # Shared by all devices, fragments of every meter are encoded once per process
+    __serializer = meterjson.MeterSerializer(indent=4)
+
+    def export_diagnostic(self, data):
+        """Format RDIAGN payload
+
+        The format is assumed and not checked against a capture of a real device: "=<STATE s<TIME t<GSM dBm"
+        line, "=<BUS name state meters" fields and one "=<ID ..<SNUM ..<LINK 1|0" line per meter, as
+        answered by um31sim. Missing tags leave the default values.
+
+        Args:
+            data (bytes): Unformatted payload from read_diagnostic()
+
+        Returns:
+            OrderedDict: The return value. "state" of concentrator, device "time" in UTC, "gsm" signal level,
+                "buses" (bus name -> OrderedDict with "state" and number of "meters") and "meters"
+                (list of OrderedDict with meterUUID, meterDescription, BUS and "online" link state).
+
+        """
+        text = data.decode("utf-8", "ignore")
+        tokenizer = _Tokenizer()
+        measurements = tokenizer.feed(text)
+        measurements.append(tokenizer.close())
+        diagnostic = OrderedDict([("state", None), ("time", None), ("gsm", None),
+                                  ("buses", OrderedDict()), ("meters", [])])
+        registry = meterregistry.get_registry("um31.uuid")
+        registry.check()
+        for row in measurements[1:]:
+            fields = OrderedDict()
+            for field in row:
+                tag, _, value = field.strip().partition(" ")
+                fields.setdefault(tag, []).append(value)
+            if "STATE" in fields:
+                diagnostic["state"] = fields["STATE"][0]
+                if "TIME" in fields:
+                    diagnostic["time"] = self.__clock.utc(fields["TIME"][0]) + "Z"
+                if "GSM" in fields:
+                    diagnostic["gsm"] = int(fields["GSM"][0])
+            elif "BUS" in fields:
+                for value in fields["BUS"]:
+                    bus = value.split()
+                    diagnostic["buses"][self.__bus_dict.get(bus[0], bus[0])] = \
+                        OrderedDict([("state", bus[1]), ("meters", int(bus[2]))])
+            elif "ID" in fields and "SNUM" in fields:
+                meter = registry.lookup("ID " + fields["ID"][0], "SNUM " + fields["SNUM"][0], self.__parse_meter)
+                diagnostic["meters"].append(OrderedDict([("meterUUID", meter.uuid),
+                                                         ("meterDescription", meter.description),
+                                                         ("BUS", meter.bus),
+                                                         ("online", fields.get("LINK", ["1"])[0] == "1")]))
+        return diagnostic
+
+    @staticmethod
+    def is_healthy(diagnostic):
+        """Full read of device is worth issuing
+
+        Args:
+            diagnostic (OrderedDict): Return value of probe() or export_diagnostic().
+
+        Returns:
+            bool: The return value. Concentrator state is OK and at least one meter is online on a working bus.
+                None if health is unknown, e.g. the response has no STATE, BUS or meter lines of assumed format.
+
+        """
+        if diagnostic is None:
+            return False
+        if diagnostic["state"] is None:
+            return None
+        if diagnostic["state"] != "OK":
+            return False
+        buses = diagnostic["buses"]
+        if not diagnostic["meters"]:
+            if not buses:
+                return None
+            return any(bus["state"] == "OK" and bus["meters"] for bus in buses.values())
+        return any(meter["online"] and buses.get(meter["BUS"], {"state": "OK"})["state"] == "OK"
+                   for meter in diagnostic["meters"])
 
     __bus_dict = dict([("0", "CAN1"),
                        ("1", "CAN2"),
@@ -0,0 +1,116 @@
+import functools
+import crcmod
+import crcmod.predefined
+
+from collections import namedtuple
+
+
+def _make_table_crc():
+    # CRC-16 with separate tables for high- and low-order bytes from UM-31 documentation, same as CRC-16/MODBUS
+    auch_crc_hi = []
+    auch_crc_lo = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        auch_crc_hi.append(crc & 0xFF)
+        auch_crc_lo.append(crc >> 8)
+
+    def table_crc(data):
+        uch_crc_hi = 0xFF
+        uch_crc_lo = 0xFF
+        for ch in data:
+            index = uch_crc_lo ^ ch
+            uch_crc_lo = uch_crc_hi ^ auch_crc_hi[index]
+            uch_crc_hi = auch_crc_lo[index]
+        return uch_crc_hi << 8 | uch_crc_lo
+
+    return table_crc
+
+
+# CRC variants for UM-31 firmwares: GSM (default), RTU, and pure Python table implementation
+CRC_FUNCTIONS = {"modbus": crcmod.predefined.mkCrcFun("modbus"),
+                 "rtu": crcmod.mkCrcFun(poly=0x18005, initCrc=0xBF40),
+                 "table": _make_table_crc()}
+
+HEX_DIGITS = frozenset(b"0123456789abcdefABCDEF")
+
+FrameError = namedtuple("FrameError", ["index", "start", "end", "expected", "actual"])
+
+
+class CRCError(ValueError):
+    """Response frames with wrong or missing CRC"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("CRC error in frames " + ", ".join(str(e.index) for e in errors))
+
+
+@functools.lru_cache(maxsize=256)
+def pack_command(password, cmd_word, crc="modbus"):
+    """Pack command in desirable format, frames are cached per password and command.
+
+    Args:
+        password (str): UM-31 password.
+        cmd_word (str): Supported command from documentation.
+        crc (str): CRC variant, key of CRC_FUNCTIONS.
+
+    Returns:
+        bytes: The return value. Formatted command to write in UM-31.
+
+    """
+    cmd_text = (password + "," + cmd_word).encode("utf-8")
+    return cmd_text + format(CRC_FUNCTIONS[crc](cmd_text), "x").encode("ascii") + b"\x0A\x0A"
+
+
+def iter_frames(data):
+    """Find CRC protected frames of response.
+
+    Frame starts with "BL" and ends with "END" followed by CRC in hex. CRC is calculated over the frame
+    from "BL" up to "END" inclusive, the same way as for commands.
+
+    Args:
+        data (bytes): Response from UM-31.
+
+    Yields:
+        tuple: (start, end, crc_end) offsets, data[start:end] is protected, data[end:crc_end] is CRC.
+
+    """
+    size = len(data)
+    pos = 0
+    while True:
+        start = data.find(b"BL", pos)
+        if start < 0:
+            return
+        end = data.find(b"END", start)
+        if end < 0:
+            return
+        end += 3
+        crc_end = end
+        while crc_end < size and crc_end - end < 4 and data[crc_end] in HEX_DIGITS:
+            crc_end += 1
+        yield start, end, crc_end
+        pos = crc_end
+
+
+def verify_response(data, crc="modbus"):
+    """Check CRC of every frame of response, without copying data.
+
+    Args:
+        data (bytes): Response from UM-31.
+        crc (str): CRC variant, key of CRC_FUNCTIONS.
+
+    Returns:
+        list of FrameError: The return value. Frames with wrong or missing CRC, empty if response is correct.
+
+    """
+    crc_func = CRC_FUNCTIONS[crc]
+    errors = []
+    with memoryview(data) as view:
+        for index, (start, end, crc_end) in enumerate(iter_frames(data)):
+            with view[start:end] as frame:
+                expected = crc_func(frame)
+            actual = int(data[end:crc_end], 16) if crc_end > end else None
+            if actual != expected:
+                errors.append(FrameError(index, start, end, expected, actual))
+    return errors
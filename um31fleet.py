@@ -0,0 +1,137 @@
+import time
+import serial
+import um31
+import um31codec
+import batchcodec
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class UM31Fleet:
+    """Class for parallel polling of several UM-31GSM Devices, one worker per serial port"""
+
+    def __init__(self, devices, timeout=60):
+        """
+        Args:
+            devices (list): Serial ports (str) or dicts with UM31.connect() parameters, "port" key is required.
+            timeout (int): Time limit in seconds for one device to connect, read and disconnect.
+
+        """
+        self.devices = OrderedDict()
+        for device in devices:
+            if isinstance(device, str):
+                device = {"port": device}
+            self.devices[device["port"]] = dict(device)
+        self.timeout = timeout
+
+    def __poll_device(self, um, params, cmd):
+        try:
+            um.connect(**params)
+            return cmd(um)
+        except (serial.SerialException, um31codec.CRCError) as e:
+            print("Can't read", params["port"] + ":", e)
+            return None
+        finally:
+            um.disconnect()
+
+    def poll(self, cmd=um31.UM31.read_current_values):
+        """Execute the same read command on all devices in parallel.
+
+        Args:
+            cmd (function): Function taking connected UM31 and returning payload, e.g. UM31.read_current_values.
+
+        Returns:
+            OrderedDict: The return value. Port -> (UM31, unformatted payload or None if device failed or timed out).
+
+        """
+        start = time.monotonic()
+        instruments = OrderedDict((port, um31.UM31()) for port in self.devices)
+        executor = ThreadPoolExecutor(max_workers=max(len(self.devices), 1))
+        futures = OrderedDict()
+        for port, params in self.devices.items():
+            futures[port] = executor.submit(self.__poll_device, instruments[port], params, cmd)
+        wait(futures.values(), timeout=self.timeout)
+        # Don't wait for hung devices, closing the port interrupts their blocking read
+        executor.shutdown(wait=False)
+
+        results = OrderedDict()
+        for port, future in futures.items():
+            if future.done():
+                results[port] = (instruments[port], future.result())
+            else:
+                print("Timeout reading", port, "after", self.timeout, "sec")
+                instruments[port].abort()
+                results[port] = (instruments[port], None)
+        print("Polled", len(self.devices), "devices in", round(time.monotonic() - start, 1), "sec")
+        return results
+
+    def read_current_values(self):
+        """Read current values from all devices in parallel.
+
+        Returns:
+            OrderedDict: The return value. Port -> (UM31, unformatted payload or None).
+
+        """
+        return self.poll(um31.UM31.read_current_values)
+
+    def read_month_values(self, month):
+        """Read values for selected month from all devices in parallel.
+
+        Args:
+            month (int): Month to read values for, should be in range(1..12).
+
+        Returns:
+            OrderedDict: The return value. Port -> (UM31, unformatted payload or None).
+
+        """
+        return self.poll(lambda um: um.read_month_values(month))
+
+    @staticmethod
+    def export_records(results):
+        """Combine payloads of all successfully read devices in one list of meter records.
+
+        Args:
+            results (OrderedDict): Return value of poll().
+
+        Returns:
+            list of OrderedDict: The return value. Meter records of all meters in order of devices.
+
+        """
+        records = []
+        for um, data in results.values():
+            if data:
+                records.extend(um.export_records(data))
+        return records
+
+    @staticmethod
+    def export_json(results):
+        """Combine payloads of all successfully read devices in one list of JSON strings.
+
+        Args:
+            results (OrderedDict): Return value of poll().
+
+        Returns:
+            list of str: The return value. JSON strings of all meters in order of devices.
+
+        """
+        json_list = []
+        for um, data in results.values():
+            if data:
+                json_list.extend(um.export_json(data))
+        return json_list
+
+    @staticmethod
+    def export_batch(results, encoding="json", compress=False):
+        """Combine payloads of all successfully read devices in one compact document.
+
+        Args:
+            results (OrderedDict): Return value of poll().
+            encoding (str): One of "json", "msgpack" or "cbor".
+            compress (bool): Compress document with zlib.
+
+        Returns:
+            bytes: The return value. Encoded document, decoded with batchcodec.decode_batch().
+
+        """
+        return batchcodec.encode_batch(UM31Fleet.export_records(results), encoding, compress)
@@ -0,0 +1,275 @@
+import os
+import tty
+import time
+import random
+import select
+import socket
+import threading
+import um31codec
+
+from datetime import datetime, timedelta
+
+
+class UM31Simulator:
+    """UM-31GSM Device simulator on a pseudo-terminal or behind a TCP serial gateway.
+
+    Answers READCURR, READMONTH=MM, RDIAGN and GETDATETIME to UM31 connected to the port property.
+    Output is paced to the baud rate, optionally with random start delay and corrupted frames.
+    In TCP mode the port is a socket:// URL accepting one connection at a time, like a gateway port.
+
+    """
+
+    channels = ("A+0", "A+1", "A+2", "A-0", "R+0", "R-0")
+
+    def __init__(self,
+                 meters=10,
+                 baudrate=9600,
+                 jitter=0.0,
+                 corruption=0.0,
+                 page_size=10,
+                 password="00000000",
+                 crc="modbus",
+                 utc_offset=3,
+                 clock_drift=0.0,
+                 seed=0,
+                 tcp=False):
+        """
+        Args:
+            meters (int): Number of meters.
+            baudrate (int): Simulated line speed, 10 bits per byte. None for no pacing.
+            jitter (float): Max random delay in seconds before response.
+            corruption (float): Probability for every response frame to have a corrupted byte.
+            page_size (int): Number of meters in one CRC protected frame.
+            password (str): Commands with other password are ignored.
+            crc (str): CRC variant, key of um31codec.CRC_FUNCTIONS.
+            utc_offset (int): Hours between device clock and UTC.
+            clock_drift (float): Seconds the device clock is ahead of its time zone.
+            seed (int): Random seed for meters, values and faults.
+            tcp (bool): Listen on a local TCP port instead of a pseudo-terminal.
+
+        """
+        self.baudrate = baudrate
+        self.jitter = jitter
+        self.corruption = corruption
+        self.page_size = page_size
+        self.password = password
+        self.crc = crc
+        self.utc_offset = utc_offset
+        self.clock_drift = clock_drift
+        self.random = random.Random(seed)
+        self.meters = []
+        for i in range(meters):
+            self.meters.append({"id": str(i + 1) + ";" + str(i % 7) + ";" + self.random.choice("01234") + ";"
+                                      + self.random.choice(["1", "3", "4", "5"]),
+                                "snum": format(self.random.randrange(10 ** 8), "08d"),
+                                "online": self.random.random() > 0.05,
+                                "values": [self.random.random() * 100000 for _ in self.channels]})
+        self.state = "OK"
+        self.buses = {"0": "OK", "1": "OK", "2": "OK", "3": "OK", "4": "OK"}
+        self.tcp = tcp
+        self.commands = []
+        # Number of accepted TCP connections
+        self.connections = 0
+        self.__master = None
+        self.__slave = None
+        self.__listener = None
+        self.__send = None
+        self.__thread = None
+        self.__stopped = threading.Event()
+        self.__drop = threading.Event()
+
+    @property
+    def port(self):
+        """Serial port or URL for UM31.connect()"""
+        if self.tcp:
+            return "socket://%s:%d" % self.__listener.getsockname()
+        return os.ttyname(self.__slave)
+
+    def start(self):
+        self.__stopped.clear()
+        if self.tcp:
+            self.__listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.__listener.bind(("127.0.0.1", 0))
+            self.__listener.listen(1)
+            self.__thread = threading.Thread(target=self.__serve_tcp, daemon=True)
+        else:
+            self.__master, self.__slave = os.openpty()
+            tty.setraw(self.__slave)
+            self.__send = lambda data: os.write(self.__master, data)
+            self.__thread = threading.Thread(target=self.__serve, daemon=True)
+        self.__thread.start()
+        return self.port
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+        if self.tcp:
+            self.__listener.close()
+        else:
+            os.close(self.__master)
+            os.close(self.__slave)
+
+    def drop_connection(self):
+        """Close TCP connection from the gateway side, like a dropped GSM link"""
+        self.__drop.set()
+
+    def device_time(self):
+        return datetime.utcnow() + timedelta(hours=self.utc_offset, seconds=self.clock_drift)
+
+    def __frame(self, text):
+        # Frame with CRC over text up to "END" inclusive, corrupted after CRC calculation
+        data = bytearray(text.encode("utf-8"))
+        crc = um31codec.CRC_FUNCTIONS[self.crc](bytes(data))
+        if self.random.random() < self.corruption:
+            # Only payload bytes between "BLnnnn" header and the line with end word, keeping line framing
+            start = 6 if data.startswith(b"BL") else 0
+            end = data.rfind(b"\n") + 1
+            positions = [pos for pos in range(start, end) if data[pos] not in b"\r\n=<"]
+            if positions:
+                pos = self.random.choice(positions)
+                data[pos] ^= 0x01
+        return bytes(data) + format(crc, "x").encode("ascii") + b"\r\n"
+
+    def __pages(self, rows, end_word):
+        pages = [rows[i:i + self.page_size] for i in range(0, len(rows), self.page_size)] or [[]]
+        data = b""
+        for n, page in enumerate(pages):
+            text = "BL" + format(n + 1, "04d")
+            if n == 0:
+                text += "=<NUM " + str(len(rows)) + "\r\n"
+            text += "".join(page)
+            text += end_word if n == len(pages) - 1 else "END"
+            data += self.__frame(text)
+        return data
+
+    def response(self, cmd_word):
+        """Device response to command.
+
+        Args:
+            cmd_word (str): Supported command from documentation.
+
+        Returns:
+            bytes: The return value. Response including the stop line, None for unknown commands.
+
+        """
+        now = self.device_time()
+        if cmd_word == "READCURR":
+            rows = []
+            for meter in self.meters:
+                if not meter["online"]:
+                    continue
+                meter["values"] = [v + self.random.random() for v in meter["values"]]
+                row = "=<TD " + now.strftime("%d.%m.%Y %H:%M:%S") + " 2<ID " + meter["id"] + "<SNUM " + meter["snum"]
+                for channel, value in zip(self.channels, meter["values"]):
+                    row += "<" + channel + " " + format(value, ".3f")
+                rows.append(row + "\r\n")
+            return self.__pages(rows, "READCURREND")
+        elif cmd_word.startswith("READMONTH="):
+            month = int(cmd_word.split("=")[1])
+            rows = []
+            for meter in self.meters:
+                row = "=<ID " + meter["id"] + "<SNUM " + meter["snum"]
+                for channel, value in zip(self.channels, meter["values"]):
+                    row += "<" + channel + " " + format(value * month / 13, ".3f")
+                rows.append(row + "\r\n")
+            return self.__pages(rows, "READMONTHEND")
+        elif cmd_word == "RDIAGN":
+            text = "=<STATE " + self.state + "<TIME " + now.strftime("%d.%m.%Y %H:%M:%S") + "<GSM -71\r\n="
+            for bus, state in sorted(self.buses.items()):
+                count = sum(1 for m in self.meters if m["id"].split(";")[2] == bus)
+                text += "<BUS " + bus + " " + state + " " + str(count)
+            text += "\r\n"
+            for meter in self.meters:
+                text += "=<ID " + meter["id"] + "<SNUM " + meter["snum"] + "<LINK " + str(int(meter["online"])) + "\r\n"
+            return self.__frame(text + "END")
+        elif cmd_word == "GETDATETIME":
+            return ("GETDATETIME=" + now.strftime("%d.%m.%Y %H:%M:%S") + "\r\n").encode("utf-8") + self.__frame("END")
+        return None
+
+    def __parse_command(self, packed):
+        # "password,CMD<crc hex>" with CRC over "password,CMD"
+        text = packed.decode("utf-8", "ignore").strip()
+        for end in range(len(text), max(len(text) - 5, 0), -1):
+            crc_text = text[end:]
+            if crc_text and format(um31codec.CRC_FUNCTIONS[self.crc](text[:end].encode("utf-8")), "x") == crc_text:
+                password, _, cmd_word = text[:end].partition(",")
+                return cmd_word if password == self.password else None
+        return None
+
+    def __write(self, data):
+        if self.jitter:
+            time.sleep(self.random.random() * self.jitter)
+        if not self.baudrate:
+            self.__send(data)
+            return
+        # Chunks of 10 ms at line speed
+        chunk = max(1, self.baudrate // 1000)
+        start = time.monotonic()
+        for pos in range(0, len(data), chunk):
+            self.__send(data[pos:pos + chunk])
+            delay = start + (pos + chunk) * 10 / self.baudrate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def __serve(self):
+        buf = b""
+        while not self.__stopped.is_set():
+            readable, _, _ = select.select([self.__master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                buf += os.read(self.__master, 1024)
+            except OSError:
+                # Slave side is closed by UM31.disconnect()
+                time.sleep(0.01)
+                continue
+            buf = self.__handle(buf)
+
+    def __serve_tcp(self):
+        client = None
+        buf = b""
+        while not self.__stopped.is_set():
+            if self.__drop.is_set() and client is not None:
+                client.close()
+                client = None
+            self.__drop.clear()
+            readable, _, _ = select.select([self.__listener] + ([client] if client else []), [], [], 0.1)
+            if self.__listener in readable:
+                # New connection replaces the previous one
+                if client is not None:
+                    client.close()
+                client, _ = self.__listener.accept()
+                self.__send = client.sendall
+                self.connections += 1
+                buf = b""
+                continue
+            if client in readable:
+                try:
+                    data = client.recv(1024)
+                except OSError:
+                    data = b""
+                if not data:
+                    client.close()
+                    client = None
+                    continue
+                try:
+                    buf = self.__handle(buf + data)
+                except OSError:
+                    # Client closed connection in the middle of response
+                    client.close()
+                    client = None
+        if client is not None:
+            client.close()
+
+    def __handle(self, buf):
+        # Answers complete commands, returns the incomplete rest
+        while b"\n\n" in buf:
+            packed, buf = buf.split(b"\n\n", 1)
+            cmd_word = self.__parse_command(packed)
+            self.commands.append(cmd_word)
+            if cmd_word is None:
+                continue
+            data = self.response(cmd_word)
+            if data is not None:
+                self.__write(data)
+        return buf
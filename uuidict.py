@@ -1,30 +1,153 @@
 import uuid
 import pickle
 import os
+import shutil
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PickleStorage:
+    """Legacy storage: the whole dict in one pickle file, rewritten on every new key"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            self.replace(dict())
+            f = open(self.path, "rb")
+        with f:
+            return pickle.load(f)
+
+    def replace(self, obj):
+        with open(self.path, 'wb') as f:
+            pickle.dump(obj, f)
+
+    def version(self):
+        # Modification time changes when the file is rewritten by any process
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def add(self, key_string, uuid_string):
+        d = self.load()
+        uuid_string = d.setdefault(key_string, uuid_string)
+        self.replace(d)
+        return uuid_string
+
+
+class SqliteStorage:
+    """Indexed storage in SQLite database, one insert per new key, safe for several processes.
+
+    Legacy pickle file found at path is migrated on first open, its copy is kept as path + ".pickle".
+    Processes opening the same path at once are serialized by a lock on path + ".lock", so only one
+    of them migrates and the others open the migrated database.
+
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.__lock = threading.Lock()
+        with open(path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Checked with the lock held, other process could have migrated the file meanwhile
+            if os.path.exists(path) and os.path.getsize(path) and not self.is_sqlite(path):
+                self.migrate_pickle(path, path, timeout)
+            self.__db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__db.execute("CREATE TABLE IF NOT EXISTS uuids (key TEXT PRIMARY KEY, uuid TEXT NOT NULL)")
+
+    @staticmethod
+    def is_sqlite(path):
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+
+    @staticmethod
+    def migrate_pickle(pickle_path, sqlite_path, timeout=30):
+        """Convert legacy pickle dict file into SQLite database
+
+        Database is built in a temporary file and atomically moved to sqlite_path,
+        so pickle_path can be the same as sqlite_path.
+
+        Args:
+            pickle_path (str): Legacy pickle file.
+            sqlite_path (str): Database to create.
+            timeout (int): Time in seconds to wait for database lock.
+
+        """
+        with open(pickle_path, "rb") as f:
+            d = pickle.load(f)
+        shutil.copy2(pickle_path, pickle_path + ".pickle")
+        tmp_path = sqlite_path + "." + str(os.getpid()) + ".tmp"
+        db = sqlite3.connect(tmp_path, timeout=timeout)
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS uuids (key TEXT PRIMARY KEY, uuid TEXT NOT NULL)")
+            db.executemany("INSERT OR IGNORE INTO uuids VALUES (?, ?)", d.items())
+        db.close()
+        os.replace(tmp_path, sqlite_path)
+
+    def load(self):
+        with self.__lock:
+            return dict(self.__db.execute("SELECT key, uuid FROM uuids"))
+
+    def replace(self, obj):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                self.__db.execute("DELETE FROM uuids")
+                self.__db.executemany("INSERT INTO uuids VALUES (?, ?)", obj.items())
+                self.__db.execute("COMMIT")
+            except sqlite3.Error:
+                self.__db.execute("ROLLBACK")
+                raise
+
+    def version(self):
+        # Changes when other connections commit, commits of this connection are already known
+        with self.__lock:
+            return self.__db.execute("PRAGMA data_version").fetchone()[0]
+
+    def add(self, key_string, uuid_string):
+        # Other process could add the same key first, its uuid wins
+        with self.__lock:
+            self.__db.execute("INSERT OR IGNORE INTO uuids VALUES (?, ?)", (key_string, uuid_string))
+            return self.__db.execute("SELECT uuid FROM uuids WHERE key = ?", (key_string,)).fetchone()[0]
+
+    def close(self):
+        self.__db.close()
+
+
+STORAGES = {"pickle": PickleStorage, "sqlite": SqliteStorage}
 
 
 class UUIDict:
-    def __init__(self, db_name="dict.uuid"):
+    def __init__(self, db_name="dict.uuid", storage="sqlite"):
         self.__location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
         self.db_name = db_name
+        self.engine = STORAGES[storage](os.path.join(self.__location__, self.db_name))
         self.storage = self.read_dict()
 
     def write_dict(self, obj):
-        with open(self.db_name, 'wb') as f:
-            pickle.dump(obj, f)
+        self.engine.replace(obj)
 
     def erase_dict(self):
         self.storage = dict()
         self.write_dict(self.storage)
 
     def read_dict(self):
-        try:
-            f = open(os.path.join(self.__location__, self.db_name), "rb")
-        except OSError:
-            self.write_dict(dict())
-            f = open(os.path.join(self.__location__, self.db_name), "rb")
-            # print("Created empty dict")
-        return pickle.load(f)
+        return self.engine.load()
+
+    def version(self):
+        """Version of backing store, changed when other process writes it"""
+        return self.engine.version()
 
     def get_uuid(self, key_string):
         try:
@@ -32,10 +155,9 @@ class UUIDict:
             # print("Found record", key_string, uuid_string)
         except KeyError:
             # print("Didn't find record", key_string)
-            uuid_string = str(uuid.uuid4())
+            uuid_string = self.engine.add(key_string, str(uuid.uuid4()))
             self.storage[key_string] = uuid_string
             # print("Created new record", key_string, uuid_string)
-            self.write_dict(self.storage)
         return uuid_string
 
     def export_dict(self):